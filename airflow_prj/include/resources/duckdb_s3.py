@@ -1,12 +1,22 @@
 import configparser
+import hashlib
 import io
-from datetime import datetime
+import json
+import threading
+from datetime import UTC, datetime
 from pathlib import Path
 
 import boto3
 import duckdb
 import requests
 from airflow.models import Variable
+from botocore.exceptions import ClientError
+
+# One DuckDB database per distinct set of credentials, shared by every transformer
+# in the process. Extensions and secrets are set up once, each transformer gets its
+# own cursor.
+_connection_pool: dict[tuple, duckdb.DuckDBPyConnection] = {}
+_connection_pool_lock = threading.Lock()
 
 
 class DataLakeIngester:
@@ -40,9 +50,9 @@ class DataLakeIngester:
                 print(self.s3_client.list_buckets()[:1])
                 # print("Buckets:", [bucket["Name"] for bucket in response["Buckets"]])
             except Exception as e:
-                print(f"Failed to list S3 buckets: {str(e)}")
+                print(f"Failed to list S3 buckets: {e!s}")
         except Exception as e:
-            print(f"Failed to initialize S3 client: {str(e)}")
+            print(f"Failed to initialize S3 client: {e!s}")
 
     def _date_to_s3_key(self, process_date: datetime) -> str:
         return "gharchive/events/{}/{}/{}.json.gz".format(
@@ -55,9 +65,62 @@ class DataLakeIngester:
         response = requests.get(url)
         response.raise_for_status()
 
-        return response.content
+        return response
+
+    def _manifest_key(self, s3_key: str) -> str:
+        return f"{s3_key}.manifest.json"
+
+    def _read_manifest(self, s3_key: str) -> dict | None:
+        try:
+            response = self.s3_client.get_object(
+                Bucket="dataeng-landing-zone-957", Key=self._manifest_key(s3_key)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def _write_manifest(self, url: str, s3_key: str, response: requests.Response):
+        """Records a landed hour, written only after its upload has completed."""
+        manifest = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "content_length": len(response.content),
+            "s3_key": s3_key,
+            "sha256": hashlib.sha256(response.content).hexdigest(),
+            "ingested_at": datetime.now(UTC).isoformat(),
+        }
+        self.s3_client.put_object(
+            Bucket="dataeng-landing-zone-957",
+            Key=self._manifest_key(s3_key),
+            Body=json.dumps(manifest).encode(),
+            ContentType="application/json",
+        )
+
+    def _is_landed(self, url: str, s3_key: str) -> bool:
+        """True when the manifest matches what the source serves for url now."""
+        manifest = self._read_manifest(s3_key)
+        if manifest is None or manifest["url"] != url:
+            return False
+
+        response = requests.head(url, allow_redirects=True)
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+        if etag and manifest["etag"]:
+            return etag == manifest["etag"]
+        content_length = response.headers.get("Content-Length")
+        if content_length is None:
+            return False
+        return int(content_length) == manifest["content_length"]
+
+    def ingest_hourly_gharchive(self, process_date: datetime, force: bool = False):
+        """Copies one hour to the landing zone, unless it has already landed unchanged.
 
-    def ingest_hourly_gharchive(self, process_date: datetime):
+        Args:
+            process_date (datetime): the hourly partition to ingest
+            force (bool): transfer the hour even if it has already landed
+        """
         # self.init_s3_client()
         process_date_str = process_date.strftime("%Y-%m-%d-%H")
 
@@ -68,8 +131,13 @@ class DataLakeIngester:
         url = f"https://data.gharchive.org/{process_date_str}.json.gz"
 
         try:
-            response_content = self._get_data_from_url(url)
             target_s3_key = self._date_to_s3_key(process_date)
+            if not force and self._is_landed(url, target_s3_key):
+                print(f"Skipping {process_date_str}, already landed and unchanged")
+                return
+
+            response = self._get_data_from_url(url)
+            response_content = response.content
 
             # Upload to S3
             with io.BytesIO(response_content) as data_stream:
@@ -77,11 +145,13 @@ class DataLakeIngester:
                     data_stream, "dataeng-landing-zone-957", target_s3_key
                 )
 
+            self._write_manifest(url, target_s3_key, response)
+
             print(
                 f"Successfully uploaded to s3://dataeng-landing-zone-957/{target_s3_key}"
             )
         except Exception as e:
-            print(f"Failed to ingest data for {process_date_str}: {str(e)}")
+            print(f"Failed to ingest data for {process_date_str}: {e!s}")
             raise e
 
 
@@ -90,7 +160,6 @@ class DataLakeTransformer:
         self.dataset_base_path: str = dataset_base_path
         self.config: configparser.ConfigParser = self._load_config()
         self.con: duckdb.DuckDBPyConnection = self._init_duckdb_connection()
-        self._set_duckdb_s3_credentials()
 
     def _load_config(self) -> configparser.ConfigParser:
         config = configparser.ConfigParser()
@@ -103,19 +172,36 @@ class DataLakeTransformer:
     def _get_env_var(self, key: str) -> str:
         return Variable.get(key, "key_not_found")
 
-    def _init_duckdb_connection(self) -> duckdb.DuckDBPyConnection:
-        con = duckdb.connect()
-        con.install_extension("httpfs")
-        con.load_extension("httpfs")
-        return con
+    def _connection_key(self) -> tuple:
+        return (
+            self._get_env_var("s3_access_key_id"),
+            self._get_env_var("s3_secret_access_key"),
+        )
 
-    def _set_duckdb_s3_credentials(self):
+    def _init_duckdb_connection(self) -> duckdb.DuckDBPyConnection:
+        """Hand out a cursor on the pooled connection for these credentials."""
+        key = self._connection_key()
+        with _connection_pool_lock:
+            if key not in _connection_pool:
+                con = duckdb.connect()
+                con.install_extension("httpfs")
+                con.load_extension("httpfs")
+                self._set_duckdb_s3_credentials(con)
+                _connection_pool[key] = con
+            return _connection_pool[key].cursor()
+
+    def _set_duckdb_s3_credentials(self, con: duckdb.DuckDBPyConnection):
         """Read S3 credentials and endpoint from config file"""
         aws_access_key_id = self._get_env_var("s3_access_key_id")
         aws_secret_access_key = self._get_env_var("s3_secret_access_key")
-        # Set S3 credentials
-        self.con.execute(f"SET s3_access_key_id='{aws_access_key_id}'")
-        self.con.execute(f"SET s3_secret_access_key='{aws_secret_access_key}'")
+        # Register the S3 credentials once for every cursor of this database
+        con.execute(f"""
+                    CREATE OR REPLACE SECRET gharchive_s3 (
+                        TYPE S3,
+                        KEY_ID '{aws_access_key_id}',
+                        SECRET '{aws_secret_access_key}'
+                    )
+                    """)
 
     def _build_path(
         self, bucket: str, process_date: datetime, file_extension: str
@@ -151,7 +237,7 @@ class DataLakeTransformer:
 
     def _serialize_data(self, source_path: str):
         self.con.execute(f"""
-						 create or replace table gharchive_raw as 
+						 create or replace temp table gharchive_raw as 
 						 from read_json_auto('{source_path}', ignore_errors=true)
 						 """)
 
@@ -169,7 +255,9 @@ class DataLakeTransformer:
 			created_at AS "event_date"
 			FROM 'gharchive_raw'
 		"""
-        self.con.execute(f"CREATE OR REPLACE TABLE gharchive_clean AS FROM ({query})")
+        self.con.execute(
+            f"CREATE OR REPLACE TEMP TABLE gharchive_clean AS FROM ({query})"
+        )
 
     def _write_data_to_parquet(self, target_path: str, duckdb_table: str):
         result_table = self.con.table(f"{duckdb_table}")
@@ -200,7 +288,7 @@ class DataLakeTransformer:
             self._write_data_to_parquet(target_path, duckdb_table="gharchive_agg")
 
         except Exception as e:
-            print(f"Error in aggregate_silver_data: {str(e)}")
+            print(f"Error in aggregate_silver_data: {e!s}")
 
     def _aggregate_data(self, source_path: str):
         query = f"""
@@ -214,4 +302,6 @@ class DataLakeTransformer:
 			FROM '{source_path}'
 			GROUP BY ALL
 		"""
-        self.con.execute(f"CREATE OR REPLACE TABLE gharchive_agg AS FROM ({query})")
+        self.con.execute(
+            f"CREATE OR REPLACE TEMP TABLE gharchive_agg AS FROM ({query})"
+        )
@@ -32,7 +32,10 @@ def ingest_data(
 
     context.log.info(f"Processing date: {process_date}")
 
-    data_lake_ingester.get_ingester().ingest_hourly_gharchive(process_date)
+    ingester = data_lake_ingester.get_ingester()
+    ingester.ingest_hourly_gharchive(process_date)
+
+    return MaterializeResult(metadata=ingester.instrumentation.metadata())
 
 
 @asset(
@@ -43,7 +46,7 @@ def ingest_data(
 )
 def transform_data(
     context: AssetExecutionContext, data_lake_transformer: DataLakeTransformerResource
-):
+) -> MaterializeResult:
     context.log.info("Transforming data")
 
     # get datetiem of execution
@@ -55,7 +58,10 @@ def transform_data(
 
     context.log.info(f"Processing date: {process_date}")
 
-    data_lake_transformer.get_transformer().transform(process_date)
+    with data_lake_transformer.get_transformer() as transformer:
+        transformer.transform(process_date)
+
+    return MaterializeResult(metadata=transformer.instrumentation.metadata())
 
 
 @asset(
@@ -67,7 +73,7 @@ def transform_data(
 def aggregate_data(
     context: AssetExecutionContext,
     data_lake_transformer: DataLakeTransformerResource,
-):
+) -> MaterializeResult:
     context.log.info("Aggregating data")
 
     # get datetiem of execution
@@ -78,4 +84,8 @@ def aggregate_data(
 
     context.log.info(f"Processing date: {process_date}")
 
-    data_lake_transformer.get_transformer().aggregate_silver_data(process_date)
+    # the asset runs hourly, only fold the new silver hour into the daily gold file
+    with data_lake_transformer.get_transformer() as transformer:
+        transformer.aggregate_silver_data(process_date, incremental=True)
+
+    return MaterializeResult(metadata=transformer.instrumentation.metadata())
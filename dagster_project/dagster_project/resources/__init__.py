@@ -12,6 +12,10 @@ class DataLakeIngesterResource(ConfigurableResource):
 
 class DataLakeTransformerResource(ConfigurableResource):
     dataset_base_path: str
+    # attach DuckDB EXPLAIN ANALYZE profiles to the asset metadata
+    profile: bool = False
 
     def get_transformer(self):
-        return DataLakeTransformer(dataset_base_path=self.dataset_base_path)
+        return DataLakeTransformer(
+            dataset_base_path=self.dataset_base_path, profile=self.profile
+        )
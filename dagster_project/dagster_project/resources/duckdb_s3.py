@@ -1,13 +1,25 @@
 import configparser
+import hashlib
 import io
-from datetime import datetime
+import json
+import threading
+from datetime import UTC, datetime
 from pathlib import Path
 
 import boto3
 import duckdb
 import requests
+from botocore.exceptions import ClientError
 from dagster import EnvVar
 
+from .instrumentation import Instrumentation
+
+# One DuckDB database per distinct set of credentials, shared by every transformer
+# in the process. Extensions and secrets are set up once, each transformer gets its
+# own cursor.
+_connection_pool: dict[tuple, duckdb.DuckDBPyConnection] = {}
+_connection_pool_lock = threading.Lock()
+
 
 class DataLakeIngester:
     def __init__(self, dataset_base_path: str):
@@ -18,6 +30,7 @@ class DataLakeIngester:
         """
         self.dataset_base_path = dataset_base_path
         self.s3_client = None
+        self.instrumentation = Instrumentation()
         self._init_s3_client()
 
     def _get_env_var(self, key: str) -> str:
@@ -42,9 +55,9 @@ class DataLakeIngester:
                 response = self.s3_client.list_buckets()
                 # print("Buckets:", [bucket["Name"] for bucket in response["Buckets"]])
             except Exception as e:
-                print(f"Failed to list S3 buckets: {str(e)}")
+                print(f"Failed to list S3 buckets: {e!s}")
         except Exception as e:
-            print(f"Failed to initialize S3 client: {str(e)}")
+            print(f"Failed to initialize S3 client: {e!s}")
 
     def _date_to_s3_key(self, process_date: datetime) -> str:
         return "gharchive/events/{}/{}/{}.json.gz".format(
@@ -54,12 +67,67 @@ class DataLakeIngester:
         )
 
     def _get_data_from_url(self, url: str) -> bytes:
-        response = requests.get(url)
+        with self.instrumentation.stage("download", source=url) as record:
+            response = requests.get(url)
+            response.raise_for_status()
+            record["bytes_in"] = len(response.content)
+
+        return response
+
+    def _manifest_key(self, s3_key: str) -> str:
+        return f"{s3_key}.manifest.json"
+
+    def _read_manifest(self, s3_key: str) -> dict | None:
+        try:
+            response = self.s3_client.get_object(
+                Bucket="dataeng-landing-zone-957", Key=self._manifest_key(s3_key)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def _write_manifest(self, url: str, s3_key: str, response: requests.Response):
+        """Records a landed hour, written only after its upload has completed."""
+        manifest = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "content_length": len(response.content),
+            "s3_key": s3_key,
+            "sha256": hashlib.sha256(response.content).hexdigest(),
+            "ingested_at": datetime.now(UTC).isoformat(),
+        }
+        self.s3_client.put_object(
+            Bucket="dataeng-landing-zone-957",
+            Key=self._manifest_key(s3_key),
+            Body=json.dumps(manifest).encode(),
+            ContentType="application/json",
+        )
+
+    def _is_landed(self, url: str, s3_key: str) -> bool:
+        """True when the manifest matches what the source serves for url now."""
+        manifest = self._read_manifest(s3_key)
+        if manifest is None or manifest["url"] != url:
+            return False
+
+        response = requests.head(url, allow_redirects=True)
         response.raise_for_status()
+        etag = response.headers.get("ETag")
+        if etag and manifest["etag"]:
+            return etag == manifest["etag"]
+        content_length = response.headers.get("Content-Length")
+        if content_length is None:
+            return False
+        return int(content_length) == manifest["content_length"]
 
-        return response.content
+    def ingest_hourly_gharchive(self, process_date: datetime, force: bool = False):
+        """Copies one hour to the landing zone, unless it has already landed unchanged.
 
-    def ingest_hourly_gharchive(self, process_date: datetime):
+        Args:
+            process_date (datetime): the hourly partition to ingest
+            force (bool): transfer the hour even if it has already landed
+        """
         # self.init_s3_client()
         process_date_str = process_date.strftime("%Y-%m-%d-%H")
 
@@ -70,29 +138,44 @@ class DataLakeIngester:
         url = f"https://data.gharchive.org/{process_date_str}.json.gz"
 
         try:
-            response_content = self._get_data_from_url(url)
             target_s3_key = self._date_to_s3_key(process_date)
+            if not force and self._is_landed(url, target_s3_key):
+                print(f"Skipping {process_date_str}, already landed and unchanged")
+                return
+
+            response = self._get_data_from_url(url)
+            response_content = response.content
 
             # Upload to S3
-            with io.BytesIO(response_content) as data_stream:
+            with (
+                self.instrumentation.stage("upload", target=target_s3_key) as record,
+                io.BytesIO(response_content) as data_stream,
+            ):
                 self.s3_client.upload_fileobj(
                     data_stream, "dataeng-landing-zone-957", target_s3_key
                 )
+                record["bytes_out"] = len(response_content)
+
+            self._write_manifest(url, target_s3_key, response)
 
             print(
                 f"Successfully uploaded to s3://dataeng-landing-zone-957/{target_s3_key}"
             )
         except Exception as e:
-            print(f"Failed to ingest data for {process_date_str}: {str(e)}")
+            print(f"Failed to ingest data for {process_date_str}: {e!s}")
             raise e
 
 
 class DataLakeTransformer:
-    def __init__(self, dataset_base_path: str):
+    def __init__(self, dataset_base_path: str, profile: bool = False):
+        """
+        :param dataset_base_path: like "gharchive/events"
+        :param profile: attach DuckDB EXPLAIN ANALYZE output to the stage metrics
+        """
         self.dataset_base_path: str = dataset_base_path
         self.config: configparser.ConfigParser = self._load_config()
         self.con: duckdb.DuckDBPyConnection = self._init_duckdb_connection()
-        self._set_duckdb_s3_credentials()
+        self.instrumentation = Instrumentation(profile=profile)
 
     def _load_config(self) -> configparser.ConfigParser:
         config = configparser.ConfigParser()
@@ -105,19 +188,74 @@ class DataLakeTransformer:
     def _get_env_var(self, key: str) -> str:
         return EnvVar(key).get_value()
 
+    def _execute_stage(self, record: dict, query: str) -> int | None:
+        """
+        Run the statement of an instrumented stage and return its row count.
+
+        When profiling, the statement runs under EXPLAIN ANALYZE instead, which
+        executes it the same way but returns the profile rather than the count.
+        """
+        if self.instrumentation.profile:
+            _, record["profile"] = self.con.execute(
+                f"EXPLAIN ANALYZE {query}"
+            ).fetchone()
+            return None
+        return self.con.execute(query).fetchone()[0]
+
+    def _file_size(self, path: str) -> int | None:
+        # a missing file is left for the statement reading it to report
+        row = self.con.execute(f"SELECT size FROM read_blob('{path}')").fetchone()
+        return row[0] if row else None
+
+    def _connection_key(self) -> tuple:
+        return (
+            self._get_env_var("s3_access_key_id"),
+            self._get_env_var("s3_secret_access_key"),
+        )
+
     def _init_duckdb_connection(self) -> duckdb.DuckDBPyConnection:
-        con = duckdb.connect()
-        con.install_extension("httpfs")
-        con.load_extension("httpfs")
-        return con
+        """Hand out a cursor on the pooled connection for these credentials."""
+        key = self._connection_key()
+        with _connection_pool_lock:
+            if key not in _connection_pool:
+                con = duckdb.connect()
+                con.install_extension("httpfs")
+                con.load_extension("httpfs")
+                self._set_duckdb_s3_credentials(con)
+                _connection_pool[key] = con
+            return _connection_pool[key].cursor()
+
+    def close(self):
+        """
+        Close the cursor of this transformer, dropping its temp tables.
+
+        The pooled database stays open for the other transformers of the process.
+        """
+        self.con.close()
+
+    def __enter__(self):
+        return self
 
-    def _set_duckdb_s3_credentials(self):
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # a transformer that failed in __init__ has no cursor
+        if hasattr(self, "con"):
+            self.con.close()
+
+    def _set_duckdb_s3_credentials(self, con: duckdb.DuckDBPyConnection):
         """Read S3 credentials and endpoint from config file"""
         aws_access_key_id = self._get_env_var("s3_access_key_id")
         aws_secret_access_key = self._get_env_var("s3_secret_access_key")
-        # Set S3 credentials
-        self.con.execute(f"SET s3_access_key_id='{aws_access_key_id}'")
-        self.con.execute(f"SET s3_secret_access_key='{aws_secret_access_key}'")
+        # Register the S3 credentials once for every cursor of this database
+        con.execute(f"""
+                    CREATE OR REPLACE SECRET gharchive_s3 (
+                        TYPE S3,
+                        KEY_ID '{aws_access_key_id}',
+                        SECRET '{aws_secret_access_key}'
+                    )
+                    """)
 
     def _build_path(
         self, bucket: str, process_date: datetime, file_extension: str
@@ -149,10 +287,15 @@ class DataLakeTransformer:
         self._write_data_to_parquet(target_path, duckdb_table="gharchive_clean")
 
     def _serialize_data(self, source_path: str):
-        self.con.execute(f"""
-						 create or replace table gharchive_raw as 
+        with self.instrumentation.stage("serialize", source=source_path) as record:
+            record["bytes_in"] = self._file_size(source_path)
+            record["rows_out"] = self._execute_stage(
+                record,
+                f"""
+						 create or replace temp table gharchive_raw as 
 						 from read_json_auto('{source_path}', ignore_errors=true)
-						 """)
+						 """,
+            )
 
     def _clean_data(self):
         query = """
@@ -168,17 +311,27 @@ class DataLakeTransformer:
 			created_at AS "event_date"
 			FROM 'gharchive_raw'
 		"""
-        self.con.execute(f"CREATE OR REPLACE TABLE gharchive_clean AS FROM ({query})")
+        with self.instrumentation.stage("clean", source="gharchive_raw") as record:
+            record["rows_out"] = self._execute_stage(
+                record,
+                f"CREATE OR REPLACE TEMP TABLE gharchive_clean AS FROM ({query})",
+            )
 
     def _write_data_to_parquet(self, target_path: str, duckdb_table: str):
-        result_table = self.con.table(f"{duckdb_table}")
-        result_table.write_parquet(target_path)
+        with self.instrumentation.stage(
+            "write", source=duckdb_table, target=target_path
+        ) as record:
+            record["rows_out"] = self._execute_stage(
+                record, f"COPY {duckdb_table} TO '{target_path}' (FORMAT PARQUET)"
+            )
+            record["bytes_out"] = self._file_size(target_path)
 
-    def aggregate_silver_data(self, process_date: datetime):
+    def aggregate_silver_data(self, process_date: datetime, incremental: bool = False):
         """
         Aggregate raw data and export to parquet format.
 
         :param process_date: the process date corresponding to the daily partition to aggregate
+        :param incremental: fold only the silver hours not yet aggregated into the daily gold file
         """
         try:
             source_bucket = self._get_env_var("silver_bucket")
@@ -195,14 +348,19 @@ class DataLakeTransformer:
             source_path = f"s3://{source_bucket}/{self.dataset_base_path}/{year_month_day}/*/*.parquet"
             target_path = f"s3://{sink_bucket}/{self.dataset_base_path}/{year_month_day}/{year_month_day}.parquet"
 
+            if incremental:
+                state_path = f"s3://{sink_bucket}/{self.dataset_base_path}/{year_month_day}/_incremental"
+                self._aggregate_new_hours(source_path, target_path, state_path)
+                return
+
             self._aggregate_data(source_path)
             self._write_data_to_parquet(target_path, duckdb_table="gharchive_agg")
 
         except Exception as e:
-            print(f"Error in aggregate_silver_data: {str(e)}")
+            print(f"Error in aggregate_silver_data: {e!s}")
 
-    def _aggregate_data(self, source_path: str):
-        query = f"""
+    def _aggregate_query(self, source: str) -> str:
+        return f"""
 			SELECT 
 			event_type,
 			repo_id,
@@ -210,7 +368,93 @@ class DataLakeTransformer:
 			repo_url,
 			DATE_TRUNC('day',CAST(event_date AS TIMESTAMP)) AS event_date,
 			count(*) AS event_count
-			FROM '{source_path}'
+			FROM {source}
 			GROUP BY ALL
 		"""
-        self.con.execute(f"CREATE OR REPLACE TABLE gharchive_agg AS FROM ({query})")
+
+    def _aggregate_data(self, source_path: str):
+        query = self._aggregate_query(f"'{source_path}'")
+        with self.instrumentation.stage("aggregate", source=source_path) as record:
+            # parquet row counts come from the footers, the data is not scanned
+            record["rows_in"] = self.con.execute(
+                f"SELECT count(*) FROM '{source_path}'"
+            ).fetchone()[0]
+            record["rows_out"] = self._execute_stage(
+                record, f"CREATE OR REPLACE TEMP TABLE gharchive_agg AS FROM ({query})"
+            )
+
+    def _aggregate_new_hours(self, source_path: str, target_path: str, state_path: str):
+        """
+        Aggregate the silver hours missing from the manifest into the daily gold file.
+
+        Each new hour is aggregated on its own into a partial file next to the
+        manifest, and the gold file is rebuilt as the sum of the partials of the
+        day's silver files, so a run costs one hour instead of a day. The manifest
+        lists the silver files by path, size and modification time: a re-transformed
+        hour is aggregated again, and a run that failed before writing the manifest
+        only repeats its partials.
+        """
+        manifest_path = f"{state_path}/manifest.parquet"
+
+        source_files = [
+            row[0]
+            for row in self.con.sql(
+                f"SELECT file FROM glob('{source_path}') ORDER BY file"
+            ).fetchall()
+        ]
+        if not source_files:
+            return
+
+        self.con.execute(f"""
+			CREATE OR REPLACE TEMP TABLE silver_files AS
+			SELECT filename AS source_file, size, last_modified
+			FROM read_blob({source_files})
+		""")
+        new_files_query = "SELECT source_file FROM silver_files"
+        folded = 0
+        # listed, an exact path glob does not tell whether the manifest exists
+        state_files = [
+            row[0]
+            for row in self.con.sql(
+                f"SELECT file FROM glob('{state_path}/*.parquet')"
+            ).fetchall()
+        ]
+        if manifest_path in state_files:
+            manifest = self.con.sql(f"FROM '{manifest_path}'")
+            # manifests listing paths only are rebuilt from all the hours
+            if "size" in manifest.columns:
+                folded = manifest.aggregate("count(*)").fetchone()[0]
+                new_files_query += f" ANTI JOIN '{manifest_path}' USING (source_file, size, last_modified)"
+        new_files = [
+            row[0]
+            for row in self.con.sql(
+                f"{new_files_query} ORDER BY source_file"
+            ).fetchall()
+        ]
+        if not new_files and len(source_files) == folded:
+            return
+
+        for source_file in new_files:
+            query = self._aggregate_query(f"'{source_file}'")
+            self.con.execute(
+                f"COPY ({query}) TO '{state_path}/{Path(source_file).name}' (FORMAT PARQUET)"
+            )
+
+        partial_paths = [
+            f"{state_path}/{Path(source_file).name}" for source_file in source_files
+        ]
+        self.con.execute(f"""
+			CREATE OR REPLACE TEMP TABLE gharchive_agg AS
+			SELECT
+			event_type,
+			repo_id,
+			repo_name,
+			repo_url,
+			event_date,
+			CAST(sum(event_count) AS BIGINT) AS event_count
+			FROM read_parquet({partial_paths})
+			GROUP BY ALL
+		""")
+        self._write_data_to_parquet(target_path, duckdb_table="gharchive_agg")
+
+        self.con.execute(f"COPY silver_files TO '{manifest_path}' (FORMAT PARQUET)")
@@ -0,0 +1,109 @@
+"""Compares transforming an hour from its .json.gz and from parallel-decompressible chunks.
+
+The sample hour is re-encoded locally into --chunks chunks of every codec, then the
+projected single-pass transform of each bronze format runs in a fresh process at
+1 up to the available threads; the best of --repeat runs is reported:
+
+    python scripts/gharchive_synth.py /tmp/gharchive --events-per-hour 500000
+    python scripts/benchmark_bronze_chunks.py /tmp/gharchive/2024-10-10-00.json.gz
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import bronze_chunks
+import memory_governance
+from benchmark_utils import (
+    print_results,
+    run_isolated,
+    save_results,
+    write_empty_config,
+)
+from data_lake_transformer import DataLakeTransformer
+
+
+def write_chunks(sample: Path, directory: Path, chunks: int, codec: str) -> list[str]:
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(sample, "rb") as source:
+        parts = bronze_chunks.recompress(source, chunks, codec)
+    paths = []
+    for index, part in enumerate(parts):
+        path = directory / bronze_chunks.chunk_name(index, codec)
+        path.write_bytes(part)
+        paths.append(str(path))
+    return paths
+
+
+def transform(
+    source_path: str | list[str], target_path: str, config_path: Path, threads: int
+) -> int:
+    transformer = DataLakeTransformer(
+        "gharchive/events", config_path=config_path, threads=threads
+    )
+    transformer._copy_clean_data_to_parquet(source_path, target_path, projected=True)
+    return transformer.con.sql(f"SELECT count(*) FROM '{target_path}'").fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sample", type=Path, help="a GH Archive hour (.json.gz)")
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--codecs",
+        nargs="+",
+        choices=bronze_chunks.CODEC_SUFFIXES,
+        default=["gzip"] + (["zstd"] if bronze_chunks.zstandard else []),
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    cpus = memory_governance.available_cpus()
+    thread_counts = sorted({1, cpus} | {n for n in (2, 4, 8, 16) if n < cpus})
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = write_empty_config(Path(workdir) / "config.ini")
+        formats = {"json.gz": (str(args.sample), args.sample.stat().st_size)}
+        for codec in args.codecs:
+            paths = write_chunks(args.sample, Path(workdir) / codec, args.chunks, codec)
+            formats[f"chunks-{codec}"] = (
+                paths,
+                sum(Path(path).stat().st_size for path in paths),
+            )
+
+        for bronze_format, (source_path, size) in formats.items():
+            for threads in thread_counts:
+                best = None
+                for _ in range(args.repeat):
+                    measurement = run_isolated(
+                        transform,
+                        source_path,
+                        str(Path(workdir) / "silver.parquet"),
+                        config_path,
+                        threads,
+                    )
+                    if best is None or measurement["seconds"] < best["seconds"]:
+                        best = measurement
+                results.append(
+                    {
+                        "format": bronze_format,
+                        "threads": threads,
+                        "mb": round(size / 1024 / 1024, 2),
+                        "seconds": best["seconds"],
+                        "peak_rss_mb": best["peak_rss_mb"],
+                        "rows": best["result"],
+                        "error": best["error"],
+                    }
+                )
+
+    print_results(
+        results,
+        ["format", "threads", "mb", "seconds", "peak_rss_mb", "rows", "error"],
+    )
+    save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Compares the parquet writer profiles on file size, write time and query time.
+
+Every profile writes the silver file of one hour and the gold file aggregated
+from it. Typical downstream queries then run on each file in a fresh process;
+the best of --repeat runs is reported. Use a real or a synthetic hour:
+
+    python scripts/gharchive_synth.py /tmp/gharchive --events-per-hour 500000
+    python scripts/benchmark_parquet_profiles.py /tmp/gharchive/2024-10-10-00.json.gz
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+from benchmark_utils import (
+    print_results,
+    run_isolated,
+    save_results,
+    write_empty_config,
+)
+from data_lake_transformer import PARQUET_WRITER_PROFILES, DataLakeTransformer
+
+# {path} is the file of the profile, {repo_id} a repository present in the hour
+QUERIES = {
+    "silver": {
+        "repo_lookup": "SELECT count(*) FROM '{path}' WHERE repo_id = {repo_id}",
+        "event_type_filter": """
+            SELECT count(DISTINCT repo_id) FROM '{path}'
+            WHERE event_type = 'WatchEvent'
+        """,
+        "full_scan": "SELECT event_type, count(*) FROM '{path}' GROUP BY ALL",
+    },
+    "gold": {
+        "repo_lookup": "SELECT * FROM '{path}' WHERE repo_id = {repo_id}",
+        "top_repos": """
+            SELECT repo_name, event_count FROM '{path}'
+            WHERE event_type = 'WatchEvent'
+            ORDER BY event_count DESC LIMIT 10
+        """,
+    },
+}
+
+
+def write_silver(
+    sample: str, target_path: str, config_path: Path, writer_profile: str
+) -> int:
+    transformer = DataLakeTransformer("gharchive/events", config_path=config_path)
+    transformer._copy_clean_data_to_parquet(
+        sample, target_path, projected=True, writer_profile=writer_profile
+    )
+    return transformer.con.sql(f"SELECT count(*) FROM '{target_path}'").fetchone()[0]
+
+
+def write_gold(
+    silver_path: str, target_path: str, config_path: Path, writer_profile: str
+) -> int:
+    transformer = DataLakeTransformer("gharchive/events", config_path=config_path)
+    transformer._aggregate_data(f"'{silver_path}'")
+    transformer._write_data_to_parquet(
+        target_path, duckdb_table="gharchive_agg", writer_profile=writer_profile
+    )
+    return transformer.con.sql(f"SELECT count(*) FROM '{target_path}'").fetchone()[0]
+
+
+def time_queries(queries: dict, path: str, repo_id: int, repeat: int) -> dict:
+    con = duckdb.connect()
+    timings = {}
+    for name, query in queries.items():
+        query = query.format(path=path, repo_id=repo_id)
+        best = None
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            con.execute(query).fetchall()
+            elapsed = time.perf_counter() - started_at
+            best = elapsed if best is None else min(best, elapsed)
+        timings[f"{name}_ms"] = round(best * 1000, 1)
+    return timings
+
+
+def _parquet_stats(path: Path) -> dict:
+    row_groups = duckdb.sql(
+        f"SELECT count(DISTINCT row_group_id) FROM parquet_metadata('{path}')"
+    ).fetchone()[0]
+    return {"mb": round(path.stat().st_size / 1024 / 1024, 2), "row_groups": row_groups}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sample", type=Path, help="a GH Archive hour (.json.gz)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        choices=PARQUET_WRITER_PROFILES,
+        default=list(PARQUET_WRITER_PROFILES),
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = write_empty_config(Path(workdir) / "config.ini")
+        repo_id = None
+
+        for profile in args.profiles:
+            silver_path = Path(workdir) / f"silver-{profile}.parquet"
+            gold_path = Path(workdir) / f"gold-{profile}.parquet"
+            writes = {
+                "silver": run_isolated(
+                    write_silver,
+                    str(args.sample),
+                    str(silver_path),
+                    config_path,
+                    profile,
+                ),
+                "gold": run_isolated(
+                    write_gold, str(silver_path), str(gold_path), config_path, profile
+                ),
+            }
+
+            if repo_id is None and silver_path.exists():
+                # a repository from the middle of the popularity distribution
+                repo_id = duckdb.sql(f"""
+                    SELECT repo_id FROM '{silver_path}'
+                    GROUP BY repo_id ORDER BY count(*) DESC, repo_id
+                    LIMIT 1 OFFSET 100
+                """).fetchone()[0]
+
+            for zone, path in (("silver", silver_path), ("gold", gold_path)):
+                measurement = writes[zone]
+                row = {
+                    "profile": profile,
+                    "zone": zone,
+                    "write_s": measurement["seconds"],
+                    "rows": measurement["result"],
+                    "error": measurement["error"],
+                }
+                if measurement["error"] is None:
+                    row.update(_parquet_stats(path))
+                    row.update(
+                        run_isolated(
+                            time_queries,
+                            QUERIES[zone],
+                            str(path),
+                            repo_id,
+                            args.repeat,
+                        )["result"]
+                    )
+                results.append(row)
+
+    columns = ["profile", "zone", "write_s", "mb", "row_groups", "rows"]
+    query_columns = list(
+        dict.fromkeys(f"{name}_ms" for queries in QUERIES.values() for name in queries)
+    )
+    print_results(results, columns + query_columns + ["error"])
+    save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Runs ingest -> transform -> aggregate offline and reports per-stage metrics.
+
+S3 is replaced by a local moto server and data.gharchive.org by a local HTTP
+server that serves synthetic hours from a temporary directory, so the whole
+pipeline can be measured without credentials or network access:
+
+    pip install "moto[server]"
+    python scripts/benchmark_pipeline.py --hours 6 --events-per-hour 200000
+
+Each stage runs in a fresh process and reports wall time, peak RSS, bytes read
+and written, and rows per second. With --fused, ingest and transform run as one
+stage that transforms from the local download (see main_fused.py).
+"""
+
+import argparse
+import functools
+import http.server
+import socket
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import boto3
+import duckdb
+import gharchive_synth
+from benchmark_utils import print_results, run_isolated, save_results
+from data_lake_ingester import DataLakeIngester
+from data_lake_transformer import DataLakeTransformer
+from main_fused import ingest_and_transform
+
+LANDING_BUCKET = "dataeng-landing-zone-957"
+SILVER_BUCKET = "benchmark-silver"
+GOLD_BUCKET = "benchmark-gold"
+
+TRANSFORM_MODES = {
+    "staged": {},
+    "projected": {"projected": True},
+    "single_pass": {"projected": True, "single_pass": True},
+}
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _write_config(path: Path, s3_endpoint_url: str, source_base_url: str) -> Path:
+    path.write_text(f"""[aws]
+s3_access_key_id = benchmark
+s3_secret_access_key = benchmark
+s3_region_name = us-east-1
+s3_endpoint_url = {s3_endpoint_url}
+
+[datalake]
+bronze_bucket = {LANDING_BUCKET}
+silver_bucket = {SILVER_BUCKET}
+gold_bucket = {GOLD_BUCKET}
+
+[ingest]
+source_base_url = {source_base_url}
+retry_backoff_seconds = 0.1
+""")
+    return path
+
+
+def _bucket_bytes(s3_client, *buckets: str) -> int:
+    total = 0
+    for bucket in buckets:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket):
+            total += sum(item["Size"] for item in page.get("Contents", []))
+    return total
+
+
+def run_ingest(config_path: Path, hours: list[datetime]) -> None:
+    summary = DataLakeIngester("gharchive/events", config_path).ingest_range(
+        hours[0], hours[-1]
+    )
+    if summary["hours_failed"]:
+        raise RuntimeError(f"ingest failed for {summary['hours_failed']}")
+
+
+def run_transform(config_path: Path, hours: list[datetime], options: dict) -> int:
+    transformer = DataLakeTransformer("gharchive/events", config_path)
+    for hour in hours:
+        transformer.transform(hour, **options)
+    return transformer.read_silver(hours[0], hours[-1]).count("*").fetchone()[0]
+
+
+def run_fused(config_path: Path, hours: list[datetime], options: dict) -> int:
+    ingester = DataLakeIngester("gharchive/events", config_path)
+    transformer = DataLakeTransformer("gharchive/events", config_path)
+    for hour in hours:
+        ingest_and_transform(ingester, transformer, hour, **options)
+    return transformer.read_silver(hours[0], hours[-1]).count("*").fetchone()[0]
+
+
+def run_aggregate(config_path: Path, hours: list[datetime]) -> int:
+    transformer = DataLakeTransformer("gharchive/events", config_path)
+    day = hours[0].replace(hour=0)
+    while day <= hours[-1]:
+        transformer.aggregate_silver_data(day)
+        day += timedelta(days=1)
+    return transformer.read_silver(hours[0], hours[-1]).count("*").fetchone()[0]
+
+
+def main():
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise SystemExit('The benchmark needs moto: pip install "moto[server]"')
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--start", default="2024-10-10-00", help="YYYY-MM-DD-HH")
+    parser.add_argument("--hours", type=int, default=3)
+    parser.add_argument("--events-per-hour", type=int, default=100_000)
+    parser.add_argument("--repos", type=int, default=1_000_000)
+    parser.add_argument("--actors", type=int, default=500_000)
+    parser.add_argument(
+        "--transform-mode", choices=TRANSFORM_MODES, default="single_pass"
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="transform each hour from the local download while it lands",
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, "%Y-%m-%d-%H")
+    hours = [start + timedelta(hours=offset) for offset in range(args.hours)]
+
+    s3_port = _free_port()
+    s3_server = ThreadedMotoServer(ip_address="127.0.0.1", port=s3_port, verbose=False)
+    s3_server.start()
+    s3_endpoint_url = f"http://127.0.0.1:{s3_port}"
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source_dir = Path(workdir) / "gharchive"
+        source_dir.mkdir()
+        gharchive_synth.generate_hours(
+            duckdb.connect(),
+            str(source_dir),
+            start,
+            len(hours),
+            args.events_per_hour,
+            repos=args.repos,
+            actors=args.actors,
+        )
+        source_bytes = sum(path.stat().st_size for path in source_dir.iterdir())
+
+        handler = functools.partial(_QuietHandler, directory=source_dir)
+        http_server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        source_base_url = f"http://127.0.0.1:{http_server.server_address[1]}"
+
+        config_path = _write_config(
+            Path(workdir) / "config.ini", s3_endpoint_url, source_base_url
+        )
+
+        s3_client = boto3.client(
+            "s3",
+            endpoint_url=s3_endpoint_url,
+            aws_access_key_id="benchmark",
+            aws_secret_access_key="benchmark",
+            region_name="us-east-1",
+        )
+        for bucket in (LANDING_BUCKET, SILVER_BUCKET, GOLD_BUCKET):
+            s3_client.create_bucket(Bucket=bucket)
+
+        events = args.events_per_hour * len(hours)
+        transform_options = TRANSFORM_MODES[args.transform_mode]
+        if args.fused:
+            stages = [
+                (
+                    "ingest+transform",
+                    run_fused,
+                    (config_path, hours, transform_options),
+                    (),
+                    (LANDING_BUCKET, SILVER_BUCKET),
+                )
+            ]
+        else:
+            stages = [
+                ("ingest", run_ingest, (config_path, hours), (), (LANDING_BUCKET,)),
+                (
+                    "transform",
+                    run_transform,
+                    (config_path, hours, transform_options),
+                    (LANDING_BUCKET,),
+                    (SILVER_BUCKET,),
+                ),
+            ]
+        stages.append(
+            (
+                "aggregate",
+                run_aggregate,
+                (config_path, hours),
+                (SILVER_BUCKET,),
+                (GOLD_BUCKET,),
+            )
+        )
+
+        results = []
+        for name, stage, stage_args, source_buckets, target_buckets in stages:
+            bytes_read = (
+                _bucket_bytes(s3_client, *source_buckets)
+                if source_buckets
+                else source_bytes
+            )
+            written_before = _bucket_bytes(s3_client, *target_buckets)
+
+            measurement = run_isolated(stage, *stage_args)
+
+            seconds = measurement["seconds"]
+            # the ingester does not parse events, it moves every generated one
+            rows = events if name == "ingest" else measurement["result"] or 0
+            results.append(
+                {
+                    "stage": name,
+                    "seconds": seconds,
+                    "peak_rss_mb": measurement["peak_rss_mb"],
+                    "bytes_read": bytes_read,
+                    "bytes_written": _bucket_bytes(s3_client, *target_buckets)
+                    - written_before,
+                    "rows": rows,
+                    "rows_per_s": round(rows / seconds) if seconds else None,
+                    "error": measurement["error"],
+                }
+            )
+
+        http_server.shutdown()
+
+    s3_server.stop()
+
+    print_results(
+        results,
+        [
+            "stage",
+            "seconds",
+            "peak_rss_mb",
+            "bytes_read",
+            "bytes_written",
+            "rows",
+            "rows_per_s",
+            "error",
+        ],
+    )
+    save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
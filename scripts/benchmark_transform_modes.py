@@ -0,0 +1,81 @@
+"""Compares wall time and peak RSS of the transform execution modes on one hour.
+
+Download a sample hour first, for example:
+
+    curl -O https://data.gharchive.org/2024-10-10-15.json.gz
+    python scripts/benchmark_transform_modes.py 2024-10-10-15.json.gz
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmark_utils import (
+    print_results,
+    run_isolated,
+    save_results,
+    write_empty_config,
+)
+from data_lake_transformer import DataLakeTransformer
+
+MODES = {
+    "staged": {"projected": False, "single_pass": False},
+    "projected": {"projected": True, "single_pass": False},
+    "single_pass": {"projected": False, "single_pass": True},
+    "single_pass_projected": {"projected": True, "single_pass": True},
+}
+
+
+def run_mode(
+    sample: str, target_path: str, config_path: Path, projected: bool, single_pass: bool
+) -> int:
+    transformer = DataLakeTransformer("gharchive/events", config_path=config_path)
+
+    if single_pass:
+        transformer._copy_clean_data_to_parquet(sample, target_path, projected)
+    else:
+        if projected:
+            transformer._serialize_projected_data(sample)
+            transformer._clean_data(source_table="gharchive_projected")
+        else:
+            transformer._serialize_data(sample)
+            transformer._clean_data()
+        transformer._write_data_to_parquet(target_path, duckdb_table="gharchive_clean")
+
+    return transformer.con.sql(f"SELECT count(*) FROM '{target_path}'").fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sample", type=Path, help="a GH Archive hour (.json.gz)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = write_empty_config(Path(workdir) / "config.ini")
+
+        for mode, options in MODES.items():
+            for run in range(args.repeat):
+                target_path = str(Path(workdir) / f"{mode}-{run}.parquet")
+                measurement = run_isolated(
+                    run_mode, str(args.sample), target_path, config_path, **options
+                )
+                results.append(
+                    {
+                        "mode": mode,
+                        "run": run,
+                        "seconds": measurement["seconds"],
+                        "peak_rss_mb": measurement["peak_rss_mb"],
+                        "rows": measurement["result"],
+                        "error": measurement["error"],
+                    }
+                )
+
+    print_results(results, ["mode", "run", "seconds", "peak_rss_mb", "rows", "error"])
+    save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import json
+import multiprocessing
+import queue
+import resource
+import signal
+import time
+from pathlib import Path
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process' resident memory.
+
+    VmHWM belongs to the address space, so unlike ru_maxrss it does not carry
+    over the parent's peak into a freshly spawned process.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _measure(queue, func, args, kwargs):
+    started_at = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        error = None
+    except Exception as e:  # noqa: BLE001 - a failed case is reported, not raised
+        result = None
+        error = f"{type(e).__name__}: {e}"
+    queue.put(
+        {
+            "seconds": round(time.perf_counter() - started_at, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "result": result,
+            "error": error,
+        }
+    )
+
+
+def run_isolated(func, *args, **kwargs) -> dict:
+    """Runs func in a fresh process and returns its wall time and peak RSS.
+
+    A new process per run keeps the peak RSS of one benchmark case from leaking
+    into the next one. func and its arguments must be picklable. A process that
+    dies without a result, e.g. OOM-killed, is reported in the error of the
+    measurement.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(results, func, args, kwargs))
+    started_at = time.perf_counter()
+    process.start()
+    measurement = None
+    while measurement is None and process.is_alive():
+        try:
+            measurement = results.get(timeout=1)
+        except queue.Empty:
+            pass
+    if measurement is None:
+        # the result may have been flushed just before the process exited
+        try:
+            measurement = results.get(timeout=1)
+        except queue.Empty:
+            measurement = {
+                "seconds": round(time.perf_counter() - started_at, 3),
+                "peak_rss_mb": None,
+                "result": None,
+                "error": _exit_reason(process.exitcode),
+            }
+    process.join()
+    return measurement
+
+
+def _exit_reason(exitcode: int | None) -> str:
+    if exitcode is not None and exitcode < 0:
+        return f"killed by {signal.Signals(-exitcode).name}"
+    return f"exited with code {exitcode} without a result"
+
+
+def write_empty_config(path: Path) -> Path:
+    """Writes a config.ini without credentials, for benchmarks on local files."""
+    path.write_text("[aws]\ns3_access_key_id =\ns3_secret_access_key =\n")
+    return path
+
+
+def print_results(results: list[dict], columns: list[str]):
+    widths = {
+        column: max(len(column), *(len(str(row.get(column))) for row in results))
+        for column in columns
+    }
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in results:
+        print(
+            "  ".join(str(row.get(column)).ljust(widths[column]) for column in columns)
+        )
+
+
+def save_results(results: list[dict], output: Path | None):
+    if output is not None:
+        output.write_text(json.dumps(results, indent=2, default=str))
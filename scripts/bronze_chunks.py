@@ -0,0 +1,140 @@
+"""Re-encodes a gzipped GH Archive hour into independently compressed NDJSON chunks.
+
+A gzip stream can only be decompressed from its start, so DuckDB reads a
+`.json.gz` hour on a single thread however many it has. Split into N files, the
+same hour is decompressed and parsed by N threads at once:
+
+    gharchive/events/2024-10-10/15/2024-10-10-15.json.gz
+    gharchive/events/2024-10-10/15/2024-10-10-15.chunks/v20241011T020304123456/part-000.ndjson.zst
+    gharchive/events/2024-10-10/15/2024-10-10-15.chunks/v20241011T020304123456/part-001.ndjson.zst
+    ...
+    gharchive/events/2024-10-10/15/2024-10-10-15.chunks/v20241011T020304123456/_SUCCESS
+
+Each re-encoding writes a new version of the chunks and its _SUCCESS marker last,
+then deletes the older versions. Readers use the newest version with a marker
+only, so they never mix the chunks of two versions or read a partial one.
+
+zstd needs the optional zstandard package (pip install zstandard); gzip chunks
+need nothing beyond the standard library.
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from typing import BinaryIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_SUFFIXES = {"zstd": ".ndjson.zst", "gzip": ".ndjson.gz"}
+COPY_BUFFER_SIZE = 1024 * 1024
+# written after the chunks of a version, which are complete once it exists
+MARKER_NAME = "_SUCCESS"
+
+
+def chunk_prefix(s3_key: str) -> str:
+    """Directory of the chunk versions of an hour, next to its .json.gz."""
+    return s3_key.removesuffix(".json.gz") + ".chunks"
+
+
+def new_version() -> str:
+    """Directory name of a new version of chunks, sorting after the earlier ones."""
+    return datetime.now(UTC).strftime("v%Y%m%dT%H%M%S%f")
+
+
+def chunk_name(index: int, codec: str) -> str:
+    return f"part-{index:03d}{CODEC_SUFFIXES[codec]}"
+
+
+def complete_chunks(files: list[str]) -> list[str]:
+    """
+    Chunks of the newest version with a marker of each hour among files, sorted.
+
+    :param files: paths under .chunks directories, markers included; chunks of
+        versions without a marker, or written before versions, are left out
+    """
+    versions: dict[str, set[str]] = {}
+    for file in files:
+        directory, name = file.rsplit("/", 1)
+        versions.setdefault(directory, set()).add(name)
+
+    newest: dict[str, str] = {}
+    for directory, names in versions.items():
+        hour_directory, version = directory.rsplit("/", 1)
+        if MARKER_NAME in names and version > newest.get(hour_directory, ""):
+            newest[hour_directory] = version
+    return sorted(
+        f"{hour_directory}/{version}/{name}"
+        for hour_directory, version in newest.items()
+        for name in versions[f"{hour_directory}/{version}"]
+        if name != MARKER_NAME
+    )
+
+
+def _compress(block: bytes, codec: str, level: int) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(block)
+    return gzip.compress(block, level, mtime=0)
+
+
+def _line_bounds(ndjson: BinaryIO, size: int, chunks: int) -> list[tuple[int, int]]:
+    """(offset, length) of up to chunks ranges of about equal size ending on newlines."""
+    bounds = []
+    start = 0
+    for index in range(1, chunks + 1):
+        if start >= size:
+            break
+        end = size if index == chunks else max(start, size * index // chunks)
+        if end < size:
+            ndjson.seek(end)
+            end += len(ndjson.readline())
+        bounds.append((start, end - start))
+        start = end
+    return bounds
+
+
+def recompress(
+    source: BinaryIO, chunks: int, codec: str = "gzip", level: int = 3
+) -> list[bytes]:
+    """
+    Splits a gzipped NDJSON stream into compressed chunks of whole lines.
+
+    The stream is decompressed once to a temporary file, then the chunks are read
+    and compressed on a thread per core (zlib and zstd release the GIL).
+
+    :param source: file-like object of the .json.gz, e.g. an S3 response body
+    :param chunks: number of chunks, fewer for hours smaller than that many lines
+    :param codec: "zstd" or "gzip"
+    :param level: compression level of the codec
+    :return: the compressed chunks, in line order
+    """
+    if codec not in CODEC_SUFFIXES:
+        raise ValueError(
+            f"Unknown codec {codec!r}, expected one of {list(CODEC_SUFFIXES)}"
+        )
+    if codec == "zstd" and zstandard is None:
+        raise ImportError(
+            "zstd chunks need the zstandard package: pip install zstandard"
+        )
+
+    with tempfile.TemporaryFile() as ndjson:
+        with gzip.GzipFile(fileobj=source) as decompressed:
+            shutil.copyfileobj(decompressed, ndjson, COPY_BUFFER_SIZE)
+        bounds = _line_bounds(ndjson, ndjson.tell(), chunks)
+        if not bounds:
+            return []
+
+        def compress_range(bound: tuple[int, int]) -> bytes:
+            offset, length = bound
+            # pread does not move the shared file position, threads can read at once
+            return _compress(os.pread(ndjson.fileno(), length, offset), codec, level)
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(bounds), os.cpu_count() or 1)
+        ) as executor:
+            return list(executor.map(compress_range, bounds))
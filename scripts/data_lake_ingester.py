@@ -1,12 +1,26 @@
 import configparser
+import hashlib
 import io
+import json
+import random
+import shutil
 import sys
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from datetime import UTC, datetime, timedelta
 from pathlib import Path
+from urllib.parse import urlparse
 
 import boto3
+import bronze_chunks
+import duckdb
 import requests
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+from instrumentation import Instrumentation, metrics_path_from_config
 from loguru import logger
+from partition_catalog import partition_catalog_from_config
 
 logger.remove()
 
@@ -23,24 +37,57 @@ logger.add(
     colorize=True,
 )
 
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB
+LANDING_BUCKET = "dataeng-landing-zone-957"
+
+# What ingesting an hour raises once its retries are spent; ingest_range logs
+# these and goes on with the next hour. duckdb.Error comes from the catalog.
+INGEST_ERRORS = (
+    requests.RequestException,
+    BotoCoreError,
+    ClientError,
+    OSError,
+    ValueError,
+    duckdb.Error,
+)
+
+
+class _HashingReader:
+    """File-like wrapper that hashes what is read through it."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.raw.read(size)
+        self.sha256.update(chunk)
+        return chunk
+
 
 class DataLakeIngester:
-    def __init__(self, dataset_base_path: str):
+    def __init__(self, dataset_base_path: str, config_path: Path | None = None):
         """Initializes the DataLakeIngester object.
 
         Args:
             s3_path (str): like "gharchive/events"
+            config_path (Path): config.ini to use instead of the one at the repository root
         """
         self.dataset_base_path = dataset_base_path
         self.s3_client = None
-        self.config: configparser.ConfigParser = self._load_config()
+        self._host_limits: dict[str, threading.BoundedSemaphore] = {}
+        self._host_limits_lock = threading.Lock()
+        self.config: configparser.ConfigParser = self._load_config(config_path)
+        self.instrumentation = Instrumentation(metrics_path_from_config(self.config))
+        self.catalog = partition_catalog_from_config(self.config)
         self._init_s3_client()
-        self._load_config()
 
-    def _load_config(self):
+    def _load_config(self, config_path: Path | None = None):
         config = configparser.ConfigParser()
 
-        config_path = Path.joinpath(Path(__file__).parent.parent, "config.ini")
+        if config_path is None:
+            config_path = Path.joinpath(Path(__file__).parent.parent, "config.ini")
         config.read(config_path)
 
         logger.success("Config loaded from {}", config_path)
@@ -54,6 +101,9 @@ class DataLakeIngester:
                 aws_access_key_id=self.config["aws"]["s3_access_key_id"],
                 aws_secret_access_key=self.config["aws"]["s3_secret_access_key"],
                 region_name=self.config["aws"]["s3_region_name"],
+                # set to use an S3 compatible store instead of AWS
+                endpoint_url=self.config.get("aws", "s3_endpoint_url", fallback="")
+                or None,
             )
             logger.success("S3 client initialized")
         except Exception as e:
@@ -66,31 +116,491 @@ class DataLakeIngester:
             process_date.strftime("%Y-%m-%d-%H"),
         )
 
-    def _get_data_from_url(self, url: str) -> bytes:
+    def _get_data_from_url(self, url: str) -> requests.Response:
         logger.info("Downloading data from {}", url)
 
-        response = requests.get(url)
-        response.raise_for_status()
+        with self.instrumentation.stage("download", source=url) as record:
+            response = requests.get(url)
+            response.raise_for_status()
+            record["bytes_in"] = len(response.content)
         logger.success("Downloaded data from {}", url)
 
-        return response.content
+        return response
 
     def _upload_file_to_s3_path(self, content: bytes, s3_key: str):
         logger.info("Uploading data to S3: {}", s3_key)
-        self.s3_client.upload_fileobj(
-            io.BytesIO(content), "dataeng-landing-zone-957", s3_key
-        )
+        with self.instrumentation.stage("upload", target=s3_key) as record:
+            self.s3_client.upload_fileobj(io.BytesIO(content), LANDING_BUCKET, s3_key)
+            record["bytes_out"] = len(content)
         logger.success("Uploaded data to S3: {}", s3_key)
 
-    def ingest_hourly_gharchive(self, process_date: datetime):
+    def _get_transfer_config(self) -> TransferConfig:
+        """Multipart settings for streaming uploads, read from the [ingest] section.
+
+        Memory used by a streaming upload is bounded by roughly
+        part_size_mb * max_concurrency, whatever the size of the hour.
+        """
+        part_size = self.config.getint("ingest", "part_size_mb", fallback=8) * MB
+        if part_size < MIN_PART_SIZE:
+            raise ValueError("S3 multipart parts must be at least 5 MB")
+
+        return TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=self.config.getint("ingest", "max_concurrency", fallback=4),
+        )
+
+    def _stream_url_to_s3_path(self, url: str, s3_key: str) -> int:
+        """Pipe the HTTP body straight into an S3 multipart upload.
+
+        The response is read in part-sized chunks and never held in memory as a
+        whole. The raw (still gzipped) bytes are uploaded untouched, and recorded
+        in the manifest once the upload has completed.
+
+        Returns:
+            int: the number of bytes uploaded
+        """
+        logger.info("Streaming data from {} to S3: {}", url, s3_key)
+
+        transferred = []
+        with (
+            self.instrumentation.stage("stream", source=url, target=s3_key) as record,
+            requests.get(url, stream=True) as response,
+        ):
+            response.raise_for_status()
+            response.raw.decode_content = False
+            body = _HashingReader(response.raw)
+
+            self.s3_client.upload_fileobj(
+                body,
+                LANDING_BUCKET,
+                s3_key,
+                Config=self._get_transfer_config(),
+                Callback=transferred.append,
+            )
+            record["bytes_out"] = sum(transferred)
+
+        self._write_manifest(
+            url, s3_key, response.headers, body.sha256.hexdigest(), sum(transferred)
+        )
+
+        logger.success("Streamed data from {} to S3: {}", url, s3_key)
+
+        return sum(transferred)
+
+    def _download_to_spool(self, url: str, spool_path: Path) -> tuple[dict, str, int]:
+        """Stream the raw (still gzipped) HTTP body to a local file.
+
+        Returns:
+            tuple: the response headers, the SHA-256 and the size of the body
+        """
+        logger.info("Spooling data from {} to {}", url, spool_path)
+
+        with (
+            self.instrumentation.stage("download", source=url) as record,
+            requests.get(url, stream=True) as response,
+        ):
+            response.raise_for_status()
+            response.raw.decode_content = False
+            body = _HashingReader(response.raw)
+            with open(spool_path, "wb") as spool:
+                shutil.copyfileobj(body, spool, MIN_PART_SIZE)
+            record["bytes_in"] = spool_path.stat().st_size
+
+        logger.success("Spooled data from {} to {}", url, spool_path)
+
+        return response.headers, body.sha256.hexdigest(), record["bytes_in"]
+
+    def _upload_spool_to_s3_path(
+        self, url: str, spool_path: Path, s3_key: str, headers, sha256: str
+    ) -> int:
+        logger.info("Uploading {} to S3: {}", spool_path, s3_key)
+        size = spool_path.stat().st_size
+        with self.instrumentation.stage("upload", target=s3_key) as record:
+            self.s3_client.upload_file(
+                str(spool_path),
+                LANDING_BUCKET,
+                s3_key,
+                Config=self._get_transfer_config(),
+            )
+            record["bytes_out"] = size
+        self._write_manifest(url, s3_key, headers, sha256, size)
+        logger.success("Uploaded {} to S3: {}", spool_path, s3_key)
+
+        return size
+
+    def spool_hourly_gharchive(
+        self, process_date: datetime, spool_path: Path, executor: Executor
+    ) -> Future:
+        """Downloads one hour to a local file and lands it in the background.
+
+        The upload of the spool file to the landing zone is submitted to executor,
+        so the file can be read, e.g. transformed, while it is being uploaded.
+        Keep spool_path until the returned future is done.
+
+        Args:
+            process_date (datetime): the hourly partition to ingest
+            spool_path (Path): local file to download the hour to
+            executor (Executor): runs the upload
+
+        Returns:
+            Future: resolves to the number of bytes landed
+        """
+        url = self._date_to_url(process_date)
+        headers, sha256, _ = self._download_to_spool(url, spool_path)
+        return executor.submit(
+            self._upload_spool_to_s3_path,
+            url,
+            spool_path,
+            self._date_to_s3_key(process_date),
+            headers,
+            sha256,
+        )
+
+    def has_landed(self, process_date: datetime) -> bool:
+        """True when the hour is in the landing zone and unchanged at the source."""
+        return self._is_landed(
+            self._date_to_url(process_date), self._date_to_s3_key(process_date)
+        )
+
+    def _manifest_key(self, s3_key: str) -> str:
+        return f"{s3_key}.manifest.json"
+
+    def _read_manifest(self, s3_key: str) -> dict | None:
+        try:
+            response = self.s3_client.get_object(
+                Bucket=LANDING_BUCKET, Key=self._manifest_key(s3_key)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def _write_manifest(
+        self, url: str, s3_key: str, headers, sha256: str, size: int
+    ) -> None:
+        """Records a landed hour, written only after its upload has completed.
+
+        Chunks re-encoded from a previous version of the hour are removed first.
+        """
+        self._delete_chunks(s3_key)
+        manifest = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "content_length": size,
+            "s3_key": s3_key,
+            "sha256": sha256,
+            "ingested_at": datetime.now(UTC).isoformat(),
+        }
+        self.s3_client.put_object(
+            Bucket=LANDING_BUCKET,
+            Key=self._manifest_key(s3_key),
+            Body=json.dumps(manifest).encode(),
+            ContentType="application/json",
+        )
+        if self.catalog is not None:
+            self.catalog.record(
+                "bronze",
+                f"s3://{LANDING_BUCKET}/{s3_key}",
+                self._s3_key_to_hour(s3_key),
+                size,
+            )
+
+    def _s3_key_to_hour(self, s3_key: str) -> datetime:
+        return datetime.strptime(
+            Path(s3_key).name.removesuffix(".json.gz"), "%Y-%m-%d-%H"
+        )
+
+    def _delete_chunks(self, s3_key: str, keep: str | None = None) -> None:
+        """Deletes the chunk versions of an hour, except the version prefix keep.
+
+        Markers go first, so that readers stop using a version before its chunks
+        disappear.
+        """
+        prefix = bronze_chunks.chunk_prefix(s3_key) + "/"
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        keys = [
+            item["Key"]
+            for page in paginator.paginate(Bucket=LANDING_BUCKET, Prefix=prefix)
+            for item in page.get("Contents", [])
+            if keep is None or not item["Key"].startswith(keep + "/")
+        ]
+        keys.sort(key=lambda key: not key.endswith("/" + bronze_chunks.MARKER_NAME))
+        # at most 1000 keys per request
+        for start in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(
+                Bucket=LANDING_BUCKET,
+                Delete={
+                    "Objects": [{"Key": key} for key in keys[start : start + 1000]]
+                },
+            )
+        if self.catalog is not None:
+            # a version directory, or a chunk written before versions
+            for deleted in {
+                prefix + key.removeprefix(prefix).split("/")[0] for key in keys
+            }:
+                self.catalog.remove(f"s3://{LANDING_BUCKET}/{deleted}")
+
+    def recompress_hourly_gharchive(
+        self,
+        process_date: datetime,
+        chunks: int | None = None,
+        codec: str | None = None,
+    ) -> int:
+        """Re-encodes a landed hour into NDJSON chunks that decompress in parallel.
+
+        The .json.gz stays the bronze copy of record; the chunks are written next
+        to it for the transformer (see bronze_chunks), as a new version whose
+        marker is written last. The previous versions are deleted after it.
+
+        Args:
+            process_date (datetime): the hourly partition to re-encode
+            chunks (int): number of chunks, defaults to [ingest] bronze_chunks
+            codec (str): "zstd" or "gzip", defaults to [ingest] bronze_chunk_codec
+
+        Returns:
+            int: the number of chunks written
+        """
+        if chunks is None:
+            chunks = self.config.getint("ingest", "bronze_chunks", fallback=8)
+        if codec is None:
+            codec = self.config.get("ingest", "bronze_chunk_codec", fallback="gzip")
+        s3_key = self._date_to_s3_key(process_date)
+        prefix = f"{bronze_chunks.chunk_prefix(s3_key)}/{bronze_chunks.new_version()}"
+        logger.info("Re-encoding {} into {} {} chunks", s3_key, chunks, codec)
+
+        with self.instrumentation.stage(
+            "recompress", source=s3_key, target=prefix, codec=codec
+        ) as record:
+            response = self.s3_client.get_object(Bucket=LANDING_BUCKET, Key=s3_key)
+            record["bytes_in"] = response["ContentLength"]
+            parts = bronze_chunks.recompress(response["Body"], chunks, codec)
+
+            written = {}
+            for index, part in enumerate(parts):
+                chunk_key = f"{prefix}/{bronze_chunks.chunk_name(index, codec)}"
+                self.s3_client.put_object(
+                    Bucket=LANDING_BUCKET, Key=chunk_key, Body=part
+                )
+                written[chunk_key] = len(part)
+            marker = json.dumps(sorted(written)).encode()
+            marker_key = f"{prefix}/{bronze_chunks.MARKER_NAME}"
+            self.s3_client.put_object(
+                Bucket=LANDING_BUCKET, Key=marker_key, Body=marker
+            )
+            written[marker_key] = len(marker)
+            if self.catalog is not None:
+                for key, size in written.items():
+                    self.catalog.record(
+                        "bronze", f"s3://{LANDING_BUCKET}/{key}", process_date, size
+                    )
+            self._delete_chunks(s3_key, keep=prefix)
+            record["chunks"] = len(parts)
+            record["bytes_out"] = sum(len(part) for part in parts)
+
+        logger.success("Re-encoded {} into {} chunks", s3_key, len(parts))
+        return len(parts)
+
+    def _is_landed(self, url: str, s3_key: str) -> bool:
+        """True when the manifest matches what the source serves for url now.
+
+        Costs a manifest GET and a source HEAD, no data is transferred.
+        """
+        manifest = self._read_manifest(s3_key)
+        if manifest is None or manifest["url"] != url:
+            return False
+
+        response = requests.head(url, allow_redirects=True)
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+        if etag and manifest["etag"]:
+            return etag == manifest["etag"]
+        content_length = response.headers.get("Content-Length")
+        if content_length is None:
+            return False
+        return int(content_length) == manifest["content_length"]
+
+    def ingest_hourly_gharchive(
+        self, process_date: datetime, streaming: bool = False, force: bool = False
+    ) -> int:
+        """Copies one hour of GH Archive events to the landing zone.
+
+        Hours whose manifest matches the source are skipped.
+
+        Args:
+            process_date (datetime): the hourly partition to ingest
+            streaming (bool): pipe the download into a multipart upload instead of
+                buffering the whole file in memory
+            force (bool): transfer the hour even if it has already landed
+
+        Returns:
+            int: the number of bytes landed, 0 for a skipped hour
+        """
         # self.init_s3_client()
         process_date_str = process_date.strftime("%Y-%m-%d-%H")
         logger.info("Ingesting data for {}", process_date_str)
 
-        url = f"https://data.gharchive.org/{process_date_str}.json.gz"
-
-        response_content = self._get_data_from_url(url)
+        url = self._date_to_url(process_date)
 
         target_s3_key = self._date_to_s3_key(process_date)
 
-        self._upload_file_to_s3_path(response_content, target_s3_key)
+        if not force and self._is_landed(url, target_s3_key):
+            logger.info("Skipping {}, already landed and unchanged", process_date_str)
+            return 0
+
+        if streaming:
+            return self._stream_url_to_s3_path(url, target_s3_key)
+
+        response = self._get_data_from_url(url)
+
+        self._upload_file_to_s3_path(response.content, target_s3_key)
+        self._write_manifest(
+            url,
+            target_s3_key,
+            response.headers,
+            hashlib.sha256(response.content).hexdigest(),
+            len(response.content),
+        )
+
+        return len(response.content)
+
+    def _date_to_url(self, process_date: datetime) -> str:
+        source_base_url = self.config.get(
+            "ingest", "source_base_url", fallback="https://data.gharchive.org"
+        )
+        return "{}/{}.json.gz".format(
+            source_base_url.rstrip("/"), process_date.strftime("%Y-%m-%d-%H")
+        )
+
+    def _get_host_limit(self, url: str) -> threading.BoundedSemaphore:
+        """One semaphore per remote host, shared by all backfill workers."""
+        host = urlparse(url).netloc
+        with self._host_limits_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(
+                    self.config.getint("ingest", "max_connections_per_host", fallback=4)
+                )
+            return self._host_limits[host]
+
+    def _is_retryable(self, error: Exception) -> bool:
+        # a missing hour (404) will not appear by retrying, anything else might
+        if isinstance(error, requests.HTTPError):
+            status = error.response.status_code if error.response is not None else 0
+            return status == 429 or status >= 500
+        return isinstance(
+            error, (requests.RequestException, BotoCoreError, ClientError)
+        )
+
+    def _ingest_hour_with_retry(
+        self, process_date: datetime, streaming: bool, force: bool
+    ) -> int:
+        max_retries = self.config.getint("ingest", "max_retries", fallback=3)
+        backoff = self.config.getfloat("ingest", "retry_backoff_seconds", fallback=2.0)
+
+        attempt = 0
+        while True:
+            try:
+                with self._get_host_limit(self._date_to_url(process_date)):
+                    return self.ingest_hourly_gharchive(process_date, streaming, force)
+            except Exception as e:
+                if attempt >= max_retries or not self._is_retryable(e):
+                    raise
+                delay = backoff * 2**attempt + random.uniform(0, backoff)
+                attempt += 1
+                logger.warning(
+                    "Attempt {} for {} failed ({}), retrying in {:.1f}s",
+                    attempt,
+                    process_date.strftime("%Y-%m-%d-%H"),
+                    e,
+                    delay,
+                )
+                time.sleep(delay)
+
+    def ingest_range(
+        self,
+        start: datetime,
+        end: datetime,
+        max_workers: int | None = None,
+        streaming: bool = True,
+        force: bool = False,
+    ) -> dict:
+        """Ingests every hour between start and end (both inclusive) in parallel.
+
+        Args:
+            start (datetime): first hourly partition to ingest
+            end (datetime): last hourly partition to ingest
+            max_workers (int): size of the thread pool, defaults to [ingest] max_workers
+            streaming (bool): see ingest_hourly_gharchive
+            force (bool): see ingest_hourly_gharchive
+
+        Returns:
+            dict: backfill summary with the failed hours and the throughput
+        """
+        start = start.replace(minute=0, second=0, microsecond=0)
+        end = end.replace(minute=0, second=0, microsecond=0)
+        if end < start:
+            raise ValueError(f"end ({end}) is before start ({start})")
+
+        hours = []
+        process_date = start
+        while process_date <= end:
+            hours.append(process_date)
+            process_date += timedelta(hours=1)
+
+        if max_workers is None:
+            max_workers = self.config.getint("ingest", "max_workers", fallback=8)
+
+        logger.info(
+            "Ingesting {} hours from {} to {} with {} workers",
+            len(hours),
+            start.strftime("%Y-%m-%d-%H"),
+            end.strftime("%Y-%m-%d-%H"),
+            max_workers,
+        )
+
+        total_bytes = 0
+        failed = []
+        started_at = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self._ingest_hour_with_retry, hour, streaming, force
+                ): hour
+                for hour in hours
+            }
+            for future in as_completed(futures):
+                hour = futures[future]
+                try:
+                    total_bytes += future.result()
+                except INGEST_ERRORS as e:
+                    logger.error(
+                        "Failed to ingest {}: {}", hour.strftime("%Y-%m-%d-%H"), e
+                    )
+                    failed.append(hour)
+
+        elapsed = time.perf_counter() - started_at
+        ingested = len(hours) - len(failed)
+
+        summary = {
+            "hours_requested": len(hours),
+            "hours_ingested": ingested,
+            "hours_failed": [hour.strftime("%Y-%m-%d-%H") for hour in sorted(failed)],
+            "bytes": total_bytes,
+            "seconds": round(elapsed, 3),
+            "mb_per_s": round(total_bytes / MB / elapsed, 3) if elapsed else 0.0,
+            "hours_per_min": round(ingested / elapsed * 60, 3) if elapsed else 0.0,
+        }
+
+        logger.success(
+            "Ingested {}/{} hours, {:.1f} MB in {:.1f}s ({} MB/s, {} hours/min)",
+            ingested,
+            len(hours),
+            total_bytes / MB,
+            elapsed,
+            summary["mb_per_s"],
+            summary["hours_per_min"],
+        )
+
+        return summary
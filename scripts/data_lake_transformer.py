@@ -1,10 +1,24 @@
 import configparser
+import os
+import re
 import sys
-from datetime import datetime
+import tempfile
+import threading
+from datetime import UTC, datetime, timedelta
 from pathlib import Path
+from urllib.parse import urlparse
 
+import boto3
+import bronze_chunks
+import delta_tables
 import duckdb
+import gold_sketches
+import memory_governance
+from dedup_index import DedupIndex
+from instrumentation import Instrumentation, metrics_path_from_config
 from loguru import logger
+from partition_catalog import partition_catalog_from_config
+from schema_registry import SchemaRegistry
 
 logger.remove()
 
@@ -21,41 +35,307 @@ logger.add(
     colorize=True,
 )
 
-# TODO: add delta lake support
+# Explicit schema for the only fields _clean_data keeps. Passing it to read_json
+# skips schema inference and lets DuckDB ignore everything else in each event,
+# most notably the large payload struct.
+GHARCHIVE_PROJECTED_COLUMNS = {
+    "id": "VARCHAR",
+    "type": "VARCHAR",
+    "actor": "STRUCT(id BIGINT, login VARCHAR, display_login VARCHAR)",
+    "repo": "STRUCT(id BIGINT, name VARCHAR, url VARCHAR)",
+    "created_at": "TIMESTAMP",
+}
+
+# Every event type found in GH Archive, including those GitHub no longer emits.
+# Events of other types are kept, and counted as unknown_event_types in the stage
+# metrics with a warning; add new types here.
+GITHUB_EVENT_TYPES = (
+    "CommitCommentEvent",
+    "CreateEvent",
+    "DeleteEvent",
+    "DiscussionEvent",
+    "DownloadEvent",
+    "FollowEvent",
+    "ForkApplyEvent",
+    "ForkEvent",
+    "GistEvent",
+    "GollumEvent",
+    "IssueCommentEvent",
+    "IssuesEvent",
+    "MemberEvent",
+    "PublicEvent",
+    "PullRequestEvent",
+    "PullRequestReviewCommentEvent",
+    "PullRequestReviewEvent",
+    "PullRequestReviewThreadEvent",
+    "PushEvent",
+    "ReleaseEvent",
+    "SponsorshipEvent",
+    "WatchEvent",
+)
+
+# hour of a bronze file, from its .json.gz name or its .chunks directory; valid in
+# both Python and DuckDB (RE2) regular expressions
+BRONZE_HOUR_PATTERN = r"(\d{4}-\d{2}-\d{2}-\d{2})\.(?:json\.gz$|chunks/)"
+
+# day of a silver file: {day}/{hour}/..., date={day}/hour={hour}/... or _compacted/{day}/...
+SILVER_DAY_PATTERN = r"(\d{4}-\d{2}-\d{2})/"
+# hour of an hourly silver file: {day}/{hour}/... or date={day}/hour={hour}/...
+SILVER_HOUR_PATTERN = r"\d{4}-\d{2}-\d{2}/(?:hour=)?(\d{2})/"
+
+# daily silver files written by compact_silver_day are sorted by these columns
+COMPACTED_SORT_BY = ["repo_id", "event_type"]
+
+# What transforming, aggregating or compacting an hour or a day raises on missing
+# or bad data. Batch entry points log these and go on with the next hour or day.
+TRANSFORM_ERRORS = (duckdb.Error, OSError, ValueError)
+
+# Parquet writer settings, picked per zone with [datalake] silver_writer_profile and
+# gold_writer_profile. Sorting clusters the values of the sort keys into few row
+# groups, so their min/max statistics let filters on those keys skip the others.
+PARQUET_WRITER_PROFILES = {
+    # DuckDB defaults: snappy, 122880 rows per row group, insertion order
+    "default": {},
+    "scan-optimised": {
+        "compression": "zstd",
+        "compression_level": 1,
+        "row_group_size": 65_536,
+        "sort_by": ["event_type", "repo_id"],
+    },
+    "size-optimised": {
+        "compression": "zstd",
+        "compression_level": 9,
+        "row_group_size": 1_048_576,
+        "sort_by": ["repo_id", "event_type"],
+    },
+}
+
+# One DuckDB database per distinct connection config, shared by every transformer
+# in the process. Extensions and secrets are set up once, each transformer gets its
+# own cursor.
+_connection_pool: dict[tuple, duckdb.DuckDBPyConnection] = {}
+_connection_pool_lock = threading.Lock()
 
 
 class DataLakeTransformer(object):
-    def __init__(self, dataset_base_path: str):
+    def __init__(
+        self,
+        dataset_base_path: str,
+        config_path: Path | None = None,
+        profile: bool = False,
+        threads: int | None = None,
+        memory_limit: str | None = None,
+    ):
+        """
+        :param dataset_base_path: like "gharchive/events"
+        :param config_path: config.ini to use instead of the one at the repository root
+        :param profile: attach DuckDB EXPLAIN ANALYZE output to the stage metrics
+        :param threads: DuckDB worker threads, [duckdb] threads when None
+        :param memory_limit: DuckDB memory limit such as "4GB", [duckdb] memory_limit when None
+        """
         self.dataset_base_path: str = dataset_base_path
-        self.config: configparser.ConfigParser = self._load_config()
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.config: configparser.ConfigParser = self._load_config(config_path)
         self.con: duckdb.DuckDBPyConnection = self._init_duckdb_connection()
-        self._set_duckdb_s3_credentials()
+        self.instrumentation = Instrumentation(
+            metrics_path_from_config(self.config),
+            profile
+            or self.config.getboolean("metrics", "explain_analyze", fallback=False),
+        )
+        self.schema_registry = self._init_schema_registry()
+        self.dedup_index = self._init_dedup_index()
+        self.catalog = partition_catalog_from_config(self.config)
+        self.s3_client = None
         logger.success("DuckDB connection initialized")
 
-    def _load_config(self) -> configparser.ConfigParser:
+    def _init_schema_registry(self) -> SchemaRegistry | None:
+        """Registry of the raw event schema, [datalake] schema_registry, unset to disable."""
+        directory = self.config.get("datalake", "schema_registry", fallback="")
+        if not directory:
+            return None
+        return SchemaRegistry(
+            Path(directory),
+            sample_rows=self.config.getint(
+                "datalake", "schema_sample_rows", fallback=20_480
+            ),
+        )
+
+    def _init_dedup_index(self) -> DedupIndex | None:
+        """Index of the event ids written to silver, [datalake] dedup_index, unset to disable."""
+        path = self.config.get("datalake", "dedup_index", fallback="")
+        return DedupIndex(Path(path)) if path else None
+
+    def _load_config(
+        self, config_path: Path | None = None
+    ) -> configparser.ConfigParser:
         config = configparser.ConfigParser()
 
-        config_path = Path.joinpath(Path(__file__).parent.parent, "config.ini")
+        if config_path is None:
+            config_path = Path.joinpath(Path(__file__).parent.parent, "config.ini")
         config.read(config_path)
 
         logger.success("Config loaded from {}", config_path)
 
         return config
 
+    def _execute_stage(self, record: dict, query: str) -> int | None:
+        """
+        Run the statement of an instrumented stage and return its row count.
+
+        When profiling, the statement runs under EXPLAIN ANALYZE instead, which
+        executes it the same way but returns the profile rather than the count.
+        """
+        if self.instrumentation.profile:
+            _, record["profile"] = self.con.execute(
+                f"EXPLAIN ANALYZE {query}"
+            ).fetchone()
+            return None
+        return self.con.execute(query).fetchone()[0]
+
+    def _file_size(self, path: str | list[str]) -> int | None:
+        # a missing file is left for the statement reading it to report
+        files = f"'{path}'" if isinstance(path, str) else path
+        return self.con.execute(f"SELECT sum(size) FROM read_blob({files})").fetchone()[
+            0
+        ]
+
+    def _connection_key(self) -> tuple:
+        return (
+            self.config.get("aws", "s3_access_key_id"),
+            self.config.get("aws", "s3_secret_access_key"),
+            self.config.get("aws", "s3_endpoint_url", fallback=""),
+            # settings are per database, transformers with other budgets get their own
+            tuple(self._duckdb_settings().items()),
+        )
+
+    def _duckdb_settings(self) -> dict:
+        """
+        Resource settings of the DuckDB database, from the [duckdb] section.
+
+        By default the memory limit is a fraction of what the cgroup allows rather than
+        of the host's memory, and whatever does not fit spills to temp_directory, so a
+        large hour or a wide GROUP BY slows down instead of being OOM-killed. Each
+        process spills to its own duckdb_spill_<pid> directory in there, as the
+        spill files of DuckDB databases in one directory have the same names.
+        """
+        settings = {
+            "threads": self.threads
+            or self.config.getint("duckdb", "threads", fallback=0)
+            or memory_governance.available_cpus(),
+            "memory_limit": self.memory_limit
+            or self.config.get("duckdb", "memory_limit", fallback="auto"),
+            "temp_directory": str(
+                Path(
+                    self.config.get("duckdb", "temp_directory", fallback="")
+                    or tempfile.gettempdir()
+                )
+                / f"duckdb_spill_{os.getpid()}"
+            ),
+            # lets large sorts and aggregations stream, ORDER BY is still honoured
+            "preserve_insertion_order": self.config.getboolean(
+                "duckdb", "preserve_insertion_order", fallback=False
+            ),
+        }
+        if settings["memory_limit"] == "auto":
+            settings["memory_limit"] = memory_governance.memory_limit(
+                self.config.getfloat("duckdb", "memory_fraction", fallback=0.8)
+            )
+        max_temp_directory_size = self.config.get(
+            "duckdb", "max_temp_directory_size", fallback=""
+        )
+        if max_temp_directory_size:
+            settings["max_temp_directory_size"] = max_temp_directory_size
+        return settings
+
     def _init_duckdb_connection(self) -> duckdb.DuckDBPyConnection:
-        con = duckdb.connect()
-        con.install_extension("httpfs")
-        con.load_extension("httpfs")
-        logger.success("DuckDB extension httpfs installed and loaded")
-        return con
+        """Hand out a cursor on the pooled connection for this config."""
+        key = self._connection_key()
+        with _connection_pool_lock:
+            if key not in _connection_pool:
+                con = duckdb.connect()
+                con.install_extension("httpfs")
+                con.load_extension("httpfs")
+                logger.success("DuckDB extension httpfs installed and loaded")
+                self._set_duckdb_s3_credentials(con)
+                for name, value in self._duckdb_settings().items():
+                    if isinstance(value, str):
+                        value = f"'{value}'"
+                    con.execute(f"SET {name} = {value}")
+                logger.success("DuckDB settings: {}", self._duckdb_settings())
+                _connection_pool[key] = con
+            return _connection_pool[key].cursor()
+
+    def close(self):
+        """
+        Close the cursor of this transformer, dropping its temp tables.
+
+        The pooled database stays open for the other transformers of the process.
+        """
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # a transformer that failed in __init__ has no cursor
+        if hasattr(self, "con"):
+            self.con.close()
 
-    def _set_duckdb_s3_credentials(self):
+    def _s3(self):
+        """boto3 client for what DuckDB does not do on S3, deleting files."""
+        if self.s3_client is None:
+            self.s3_client = boto3.client(
+                "s3",
+                aws_access_key_id=self.config["aws"]["s3_access_key_id"],
+                aws_secret_access_key=self.config["aws"]["s3_secret_access_key"],
+                region_name=self.config["aws"]["s3_region_name"],
+                # set to use an S3 compatible store instead of AWS
+                endpoint_url=self.config.get("aws", "s3_endpoint_url", fallback="")
+                or None,
+            )
+        return self.s3_client
+
+    def _delete_files(self, paths: list[str]):
+        keys_by_bucket: dict[str, list[dict]] = {}
+        for path in paths:
+            location = urlparse(path)
+            keys_by_bucket.setdefault(location.netloc, []).append(
+                {"Key": location.path.lstrip("/")}
+            )
+        for bucket, objects in keys_by_bucket.items():
+            # at most 1000 keys per request
+            for start in range(0, len(objects), 1000):
+                self._s3().delete_objects(
+                    Bucket=bucket, Delete={"Objects": objects[start : start + 1000]}
+                )
+
+    def _set_duckdb_s3_credentials(self, con: duckdb.DuckDBPyConnection):
         """Read S3 credentials and endpoint from config file"""
         aws_access_key_id = self.config.get("aws", "s3_access_key_id")
         aws_secret_access_key = self.config.get("aws", "s3_secret_access_key")
-        # Set S3 credentials
-        self.con.execute(f"SET s3_access_key_id='{aws_access_key_id}'")
-        self.con.execute(f"SET s3_secret_access_key='{aws_secret_access_key}'")
+
+        # set to use an S3 compatible store instead of AWS
+        endpoint_options = ""
+        endpoint_url = self.config.get("aws", "s3_endpoint_url", fallback="")
+        if endpoint_url:
+            endpoint = urlparse(endpoint_url)
+            endpoint_options = f""",
+                        ENDPOINT '{endpoint.netloc}',
+                        URL_STYLE 'path',
+                        USE_SSL {str(endpoint.scheme == "https").lower()}"""
+
+        # Register the S3 credentials once for every cursor of this database
+        con.execute(f"""
+                    CREATE OR REPLACE SECRET gharchive_s3 (
+                        TYPE S3,
+                        KEY_ID '{aws_access_key_id}',
+                        SECRET '{aws_secret_access_key}'{endpoint_options}
+                    )
+                    """)
 
     def _build_path(
         self, bucket: str, process_date: datetime, file_extension: str
@@ -64,92 +344,1526 @@ class DataLakeTransformer(object):
         hour = process_date.strftime("%H")
         return f"s3://{bucket}/{self.dataset_base_path}/{year_month_day}/{hour}/{year_month_day}-{hour}.{file_extension}"
 
+    def _table_format(self) -> str:
+        """[datalake] table_format of the silver and gold zones: parquet or delta."""
+        table_format = self.config.get("datalake", "table_format", fallback="parquet")
+        if table_format not in ("parquet", "delta"):
+            raise ValueError(
+                f"Unknown table format {table_format!r}, expected parquet or delta"
+            )
+        return table_format
+
+    def _delta_uri(self, zone: str) -> str:
+        bucket = self.config.get("datalake", f"{zone}_bucket")
+        return f"s3://{bucket}/{self.dataset_base_path}/_delta"
+
+    def _write_delta(
+        self,
+        zone: str,
+        query: str,
+        partition_by: list[str],
+        predicate: str,
+        writer_profile: str = "default",
+    ) -> int:
+        """Replaces the partitions of the Delta table of zone matching predicate with query."""
+        profile = PARQUET_WRITER_PROFILES[writer_profile]
+        if profile.get("sort_by"):
+            query = f"SELECT * FROM ({query}) ORDER BY {', '.join(profile['sort_by'])}"
+
+        target_path = self._delta_uri(zone)
+        with self.instrumentation.stage(
+            "write",
+            target=target_path,
+            predicate=predicate,
+            writer_profile=writer_profile,
+        ) as record:
+            record["rows_out"] = self.con.execute(
+                f"SELECT count(*) FROM ({query})"
+            ).fetchone()[0]
+            record["version"] = delta_tables.write(
+                self.con.sql(query),
+                target_path,
+                partition_by,
+                predicate,
+                delta_tables.storage_options(self.config),
+                profile,
+            )
+        logger.success(
+            "DuckDB - {} written to Delta version {}", predicate, record["version"]
+        )
+        return record["rows_out"]
+
+    def _silver_layout_is_hive(self) -> bool:
+        return self.config.get("datalake", "silver_layout", fallback="legacy") == "hive"
+
+    def _build_silver_path(self, bucket: str, process_date: datetime) -> str:
+        """Silver file of an hour, `date=YYYY-MM-DD/hour=HH/data_0.parquet` in the hive layout."""
+        if not self._silver_layout_is_hive():
+            return self._build_path(bucket, process_date, "parquet")
+
+        year_month_day = process_date.strftime("%Y-%m-%d")
+        hour = process_date.strftime("%H")
+        return f"s3://{bucket}/{self.dataset_base_path}/date={year_month_day}/hour={hour}/data_0.parquet"
+
+    def _bronze_is_chunked(self) -> bool:
+        return (
+            self.config.get("datalake", "bronze_format", fallback="json.gz")
+            == "chunked"
+        )
+
+    def _bronze_files(self, bucket: str, hours: list[datetime]) -> list[str]:
+        """
+        Existing bronze files of hours, sorted.
+
+        With bronze_format = chunked, hours re-encoded by the ingester are read from
+        the chunks of their newest complete version (see bronze_chunks) and the
+        others from their .json.gz. The files of an hour come from the catalog when it
+        has the .json.gz of the hour, otherwise from listing the bucket.
+        """
+        # naive UTC, like the hours of the catalog and of the paths
+        hours = [
+            hour.astimezone(UTC).replace(tzinfo=None) if hour.tzinfo else hour
+            for hour in hours
+        ]
+        requested = set(hours)
+        cataloged = [
+            path
+            for path in self._cataloged_files("bronze", min(hours), max(hours))
+            if self._bronze_hour(path) in requested
+        ]
+        covered = {
+            self._bronze_hour(path) for path in cataloged if path.endswith(".json.gz")
+        }
+        cataloged = [path for path in cataloged if self._bronze_hour(path) in covered]
+        listed = self._listed_bronze_files(
+            bucket, [hour for hour in hours if hour not in covered]
+        )
+
+        if not self._bronze_is_chunked():
+            return sorted(
+                listed + [path for path in cataloged if path.endswith(".json.gz")]
+            )
+        chunk_files = bronze_chunks.complete_chunks(
+            [path for path in cataloged if ".chunks/" in path]
+        )
+        chunked = {file.rsplit("/", 2)[0] for file in chunk_files}
+        return sorted(
+            listed
+            + chunk_files
+            + [
+                path
+                for path in cataloged
+                if path.endswith(".json.gz")
+                and path.removesuffix(".json.gz") + ".chunks" not in chunked
+            ]
+        )
+
+    def _bronze_hour(self, path: str) -> datetime:
+        return datetime.strptime(
+            re.search(BRONZE_HOUR_PATTERN, path).group(1), "%Y-%m-%d-%H"
+        )
+
+    def _listed_bronze_files(self, bucket: str, hours: list[datetime]) -> list[str]:
+        """Bronze files of hours found by listing the bucket, as _bronze_files."""
+        if not hours:
+            return []
+        json_paths = [self._build_path(bucket, hour, "json.gz") for hour in hours]
+        chunk_files = []
+        if self._bronze_is_chunked():
+            chunk_globs = [
+                self._build_path(bucket, hour, "chunks") + "/*/*" for hour in hours
+            ]
+            chunk_files = bronze_chunks.complete_chunks(
+                [
+                    row[0]
+                    for row in self.con.execute(
+                        f"SELECT file FROM glob({chunk_globs})"
+                    ).fetchall()
+                ]
+            )
+            chunked = {file.rsplit("/", 2)[0] for file in chunk_files}
+            json_paths = [
+                path
+                for path in json_paths
+                if path.removesuffix(".json.gz") + ".chunks" not in chunked
+            ]
+        if not json_paths:
+            return chunk_files
+        json_files = [
+            row[0]
+            for row in self.con.execute(
+                f"SELECT file FROM glob({json_paths})"
+            ).fetchall()
+        ]
+        return chunk_files + json_files
+
+    def _writer_profile(self, zone: str) -> str:
+        """Name of the parquet writer profile of a zone ("silver" or "gold")."""
+        name = self.config.get("datalake", f"{zone}_writer_profile", fallback="default")
+        if name not in PARQUET_WRITER_PROFILES:
+            raise ValueError(
+                f"Unknown {zone} writer profile {name!r}, "
+                f"expected one of {list(PARQUET_WRITER_PROFILES)}"
+            )
+        return name
+
+    def _copy_to_parquet(
+        self,
+        query: str,
+        target_path: str,
+        writer_profile: str = "default",
+        partition_by: list[str] | None = None,
+        sort_by: list[str] | None = None,
+    ) -> str:
+        """
+        COPY statement writing the result of query with a writer profile.
+
+        :param partition_by: write hive partitions of these columns under target_path,
+            as data_0.parquet files like the hive silver layout. Only partitions up to
+            partitioned_write_max_open_files get a single file, see _allow_open_partitions
+        :param sort_by: sort the rows by these columns instead of those of the profile
+        """
+        profile = PARQUET_WRITER_PROFILES[writer_profile]
+        sort_by = sort_by or profile.get("sort_by")
+        if sort_by:
+            query = f"SELECT * FROM ({query}) ORDER BY {', '.join(sort_by)}"
+
+        options = ["FORMAT PARQUET"]
+        if "compression" in profile:
+            options.append(f"COMPRESSION {profile['compression']}")
+        if "compression_level" in profile:
+            options.append(f"COMPRESSION_LEVEL {profile['compression_level']}")
+        if "row_group_size" in profile:
+            options.append(f"ROW_GROUP_SIZE {profile['row_group_size']}")
+        if partition_by:
+            options.append(f"PARTITION_BY ({', '.join(partition_by)})")
+            options.append("FILENAME_PATTERN 'data_{i}'")
+            options.append("OVERWRITE_OR_IGNORE")
+        return f"COPY ({query}) TO '{target_path}' ({', '.join(options)})"
+
+    def _allow_open_partitions(self, partitions: int):
+        """
+        Raise partitioned_write_max_open_files to the partitions of a PARTITION_BY COPY.
+
+        Past the limit DuckDB closes the file of a partition and writes its later
+        rows to a data_1 file, and so on, where the hive layout has one file per hour.
+        The setting is global to the pooled database, so it is only ever raised.
+        """
+        with _connection_pool_lock:
+            limit = self.con.execute(
+                "SELECT current_setting('partitioned_write_max_open_files')"
+            ).fetchone()[0]
+            if limit < partitions:
+                self.con.execute(f"SET partitioned_write_max_open_files = {partitions}")
+
+    def _remove_stale_partition_files(self, silver_bucket: str, hours: list[datetime]):
+        """
+        Delete the files other than data_0.parquet of the rewritten hive partitions of hours.
+
+        A partition written again keeps the data_1, data_2... files of an earlier write
+        with more open partitions than allowed, which would be read along with the new
+        data_0.parquet. They are deleted after the write rather than before, so that
+        readers never find the hour empty.
+        """
+        if not self._silver_layout_is_hive() or self._table_format() != "parquet":
+            return
+        written = {self._build_silver_path(silver_bucket, hour) for hour in hours}
+        partitions = {path.rsplit("/", 1)[0] for path in written}
+        stale = [
+            file
+            for day in sorted({hour.date() for hour in hours})
+            for (file,) in self.con.execute(
+                f"SELECT file FROM glob('{self._silver_day_glob(silver_bucket, day)}')"
+            ).fetchall()
+            if file.rsplit("/", 1)[0] in partitions and file not in written
+        ]
+        if stale:
+            logger.info("DuckDB - deleting {} stale silver files", len(stale))
+            self._delete_files(stale)
+            if self.catalog is not None:
+                for file in stale:
+                    self.catalog.remove(file)
+
+    def _silver_day_glob(self, bucket: str, process_date: datetime) -> str:
+        year_month_day = process_date.strftime("%Y-%m-%d")
+        if self._silver_layout_is_hive():
+            return f"s3://{bucket}/{self.dataset_base_path}/date={year_month_day}/*/*.parquet"
+        return f"s3://{bucket}/{self.dataset_base_path}/{year_month_day}/*/*.parquet"
+
+    def _cataloged_files(
+        self, zone: str, start_hour: datetime, end_hour: datetime
+    ) -> list[str]:
+        if self.catalog is None:
+            return []
+        return self.catalog.files(zone, start_hour, end_hour)
+
+    def _record_silver_hours(self, silver_bucket: str, hours: list[datetime]):
+        """Records the silver files of hours, as listed once they are written."""
+        if self.catalog is None or self._table_format() == "delta":
+            return
+        for hour in hours:
+            directory = self._build_silver_path(silver_bucket, hour).rsplit("/", 1)[0]
+            for file in self._listed_files(directory):
+                self._record_in_catalog("silver", file, hour)
+
+    def _record_in_catalog(self, zone: str, path: str, partition_hour: datetime):
+        """Records a written parquet file with the statistics of its footer."""
+        # the Delta log already lists the files of a table with their statistics
+        if self.catalog is None or self._table_format() == "delta":
+            return
+        size = self._file_size(path)
+        if size is None:
+            # e.g. a partition left empty by the dedup index
+            return
+        rows, min_event_date, max_event_date = self.con.execute(f"""
+            SELECT
+            coalesce(sum(row_group_num_rows) FILTER (WHERE column_id = 0), 0),
+            min(stats_min_value) FILTER (WHERE path_in_schema = 'event_date'),
+            max(stats_max_value) FILTER (WHERE path_in_schema = 'event_date')
+            FROM parquet_metadata('{path}')
+        """).fetchone()
+        schema_hash = self.con.execute(f"""
+            SELECT md5(string_agg(
+                concat_ws(' ', name, type, converted_type, logical_type), ', '
+            ))
+            FROM parquet_schema('{path}')
+        """).fetchone()[0]
+        self.catalog.record(
+            zone,
+            path,
+            partition_hour,
+            size,
+            rows,
+            min_event_date and datetime.fromisoformat(min_event_date),
+            max_event_date and datetime.fromisoformat(max_event_date),
+            schema_hash,
+        )
+
+    def _compacted_path(self, bucket: str, process_date: datetime) -> str:
+        """Directory of the daily files of a day, outside the globs of the hourly files."""
+        return (
+            f"s3://{bucket}/{self.dataset_base_path}/_compacted/{process_date:%Y-%m-%d}"
+        )
+
+    def _silver_files_written(
+        self, start_date: datetime, end_date: datetime
+    ) -> list[str]:
+        """
+        Hourly and daily silver files of the days between start_date and end_date.
+
+        A day comes from the catalog when the catalog has a daily file or all 24
+        hours of it. The prefixes of the other days are listed, which also finds
+        the files written without the catalog, e.g. before it was enabled.
+        """
+        first_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        last_day = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        files = self._cataloged_files(
+            "silver", first_day, last_day + timedelta(hours=23)
+        )
+        cataloged_hours: dict[str, set[str]] = {}
+        for file in files:
+            hour = re.search(SILVER_HOUR_PATTERN, file)
+            cataloged_hours.setdefault(
+                re.search(SILVER_DAY_PATTERN, file).group(1), set()
+            ).add(hour.group(1) if hour and "/_compacted/" not in file else "daily")
+
+        silver_bucket = self.config.get("datalake", "silver_bucket")
+        days = []
+        day = first_day
+        while day <= last_day:
+            hours = cataloged_hours.get(f"{day:%Y-%m-%d}", set())
+            if "daily" not in hours and len(hours) < 24:
+                days.append(self._silver_day_glob(silver_bucket, day))
+                days.append(f"{self._compacted_path(silver_bucket, day)}/*.parquet")
+            day += timedelta(days=1)
+        if not days:
+            return files
+
+        listed = [
+            row[0] for row in self.con.sql(f"SELECT file FROM glob({days})").fetchall()
+        ]
+        return sorted(set(files) | set(listed))
+
+    def _silver_files(self, start_date: datetime, end_date: datetime) -> list[str]:
+        """
+        Silver files of the days between start_date and end_date (both inclusive).
+
+        A compacted day is read from its latest daily file instead of its hourly files.
+        """
+        files = self._silver_files_written(start_date, end_date)
+        daily_files = {}
+        for file in sorted(file for file in files if "/_compacted/" in file):
+            daily_files[re.search(SILVER_DAY_PATTERN, file).group(1)] = file
+        return [
+            file
+            for file in files
+            if "/_compacted/" not in file
+            and re.search(SILVER_DAY_PATTERN, file).group(1) not in daily_files
+        ] + list(daily_files.values())
+
+    def _silver_source(self, start_date: datetime, end_date: datetime) -> str:
+        """
+        FROM clause reading the silver days between start_date and end_date (both inclusive).
+
+        Days without files are skipped. In the hive layout the date/hour partition
+        columns are exposed, so filters on them are pushed down and prune files
+        before they are opened; the daily files of compacted days store them as
+        columns, whose statistics prune the same way.
+        """
+        if self._table_format() == "delta":
+            files = delta_tables.snapshot_files(
+                self.con,
+                self._delta_uri("silver"),
+                delta_tables.storage_options(self.config),
+                f""""partition.date" BETWEEN '{start_date:%Y-%m-%d}' AND '{end_date:%Y-%m-%d}'""",
+            )
+        else:
+            files = self._silver_files(start_date, end_date)
+        if not files:
+            raise FileNotFoundError(
+                f"No silver files between {start_date:%Y-%m-%d} and {end_date:%Y-%m-%d}"
+            )
+
+        if self._table_format() == "delta":
+            return f"""read_parquet(
+                {files},
+                hive_partitioning=true,
+                hive_types={{'date': DATE, 'hour': INTEGER}}
+            )"""
+
+        if not self._silver_layout_is_hive():
+            return f"read_parquet({files})"
+
+        hourly_files = [file for file in files if "/_compacted/" not in file]
+        daily_files = [file for file in files if "/_compacted/" in file]
+        hourly_source = f"""read_parquet(
+                {hourly_files},
+                hive_partitioning=true,
+                hive_types={{'date': DATE, 'hour': INTEGER}}
+            )"""
+        if not daily_files:
+            return hourly_source
+        if not hourly_files:
+            return f"read_parquet({daily_files})"
+        return f"""(
+            SELECT * FROM {hourly_source}
+            UNION ALL BY NAME
+            SELECT * FROM read_parquet({daily_files})
+        )"""
+
+    def compact_silver_day(self, process_date: datetime) -> str:
+        """
+        Rewrite the hourly silver files of a finished day into one daily file.
+
+        The daily file is sorted by repo_id and event_type, so its row group statistics
+        let lookups skip most of it, and a scan of the day opens one file instead of 24.
+        It is written under a new name next to the previous ones; readers switch to it
+        as soon as the upload completes, and the daily files it supersedes are then
+        deleted. The hourly files are left in place, a later compaction of the day is
+        rebuilt from them. An hour transformed again afterwards is only read once the
+        day is compacted again.
+
+        :param process_date: the day to compact
+        :return: the path of the daily file
+        """
+        if self._table_format() == "delta":
+            raise ValueError(
+                "Delta silver tables are compacted with DeltaTable.optimize, not here"
+            )
+        silver_bucket = self.config.get("datalake", "silver_bucket")
+        day = process_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        hourly_files = [
+            file
+            for file in self._silver_files_written(day, day)
+            if "/_compacted/" not in file
+        ]
+        if not hourly_files:
+            raise FileNotFoundError(f"No silver hours on {day:%Y-%m-%d}")
+
+        # a new name per run, a reader never sees a partly written daily file
+        written_at = datetime.now(UTC).strftime("%Y%m%dT%H%M%S")
+        target_path = f"{self._compacted_path(silver_bucket, day)}/{day:%Y-%m-%d}-{written_at}.parquet"
+        source = f"read_parquet({hourly_files})"
+        if self._silver_layout_is_hive():
+            # keeps the date and hour partition columns as regular columns
+            source = f"""read_parquet(
+                {hourly_files},
+                hive_partitioning=true,
+                hive_types={{'date': DATE, 'hour': INTEGER}}
+            )"""
+
+        logger.info(
+            "DuckDB - compacting {} silver hours of {:%Y-%m-%d}...",
+            len(hourly_files),
+            day,
+        )
+        writer_profile = self._writer_profile("silver")
+        with self.instrumentation.stage(
+            "compact",
+            source=f"{len(hourly_files)} files",
+            target=target_path,
+            writer_profile=writer_profile,
+        ) as record:
+            record["bytes_in"] = self._file_size(hourly_files)
+            record["rows_out"] = self._execute_stage(
+                record,
+                self._copy_to_parquet(
+                    f"FROM {source}",
+                    target_path,
+                    writer_profile,
+                    sort_by=COMPACTED_SORT_BY,
+                ),
+            )
+            record["bytes_out"] = self._file_size(target_path)
+        self._record_in_catalog("silver", target_path, day)
+        self._remove_superseded_daily_files(silver_bucket, day, target_path)
+        logger.success("DuckDB - silver day compacted into {}", target_path)
+        return target_path
+
+    def _remove_superseded_daily_files(
+        self, silver_bucket: str, day: datetime, target_path: str
+    ):
+        """
+        Delete the daily files of day written before target_path.
+
+        Names sort by the time they were written, so a daily file a concurrent
+        compaction of the day wrote after target_path is kept.
+        """
+        directory = self._compacted_path(silver_bucket, day)
+        listed = self._listed_files(directory)
+        cataloged = [
+            file
+            for file in self._cataloged_files("silver", day, day)
+            if file.startswith(f"{directory}/")
+        ]
+        superseded = sorted(
+            file
+            for file in set(listed) | set(cataloged)
+            if Path(file).name < Path(target_path).name
+        )
+        if not superseded:
+            return
+        logger.info("DuckDB - deleting {} superseded daily files", len(superseded))
+        self._delete_files([file for file in superseded if file in listed])
+        if self.catalog is not None:
+            for file in superseded:
+                self.catalog.remove(file)
+
+    def read_silver(
+        self, start_date: datetime, end_date: datetime
+    ) -> duckdb.DuckDBPyRelation:
+        """
+        Relation over the silver events between start_date and end_date, by day.
+
+        In the hive layout, filters on the date and hour columns of the relation
+        skip the files of the other partitions.
+
+        :param start_date: first day to read
+        :param end_date: last day to read, inclusive
+        """
+        return self.con.sql(
+            f"SELECT * FROM {self._silver_source(start_date, end_date)}"
+        )
+
     def transform(
         self,
         process_date: datetime = datetime.now().replace(
             minute=0, second=0, microsecond=0
         ),
+        projected: bool = False,
+        single_pass: bool = False,
+        source_path: str | list[str] | None = None,
     ) -> duckdb.DuckDBPyRelation:
         """
         Serialize and clean raw data, then export to parquet format on next zone.
 
         :param process_date: the process date corresponding to the hourly partition to serialise
+        :param projected: read only the columns kept by the clean step, without building the raw table
+        :param single_pass: compile read, clean and write into one COPY statement, without staged
+            tables; not possible with a dedup index or a Delta table, which need the cleaned hour
+            as a table, the hour is then staged with a warning
+        :param source_path: read the raw hour from this file instead of the bronze zone,
+            e.g. the local spool file of the ingester
         """
         bronze_bucket = self.config.get("datalake", "bronze_bucket")
         silver_bucket = self.config.get("datalake", "silver_bucket")
 
-        source_path = self._build_path(bronze_bucket, process_date, "json.gz")
-        target_path = self._build_path(silver_bucket, process_date, "parquet")
+        if source_path is None and self._bronze_is_chunked():
+            source_path = self._bronze_files(bronze_bucket, [process_date]) or None
+        if source_path is None:
+            # also when missing, so that the read reports the expected file
+            source_path = self._build_path(bronze_bucket, process_date, "json.gz")
+        target_path = self._build_silver_path(silver_bucket, process_date)
 
-        self._serialize_data(source_path)
-        self._clean_data()
-        self._write_data_to_parquet(target_path, duckdb_table="gharchive_clean")
+        writer_profile = self._writer_profile("silver")
 
-    def _serialize_data(self, source_path: str):
-        logger.info("DuckDB - serializing data...")
+        if single_pass and (
+            self.dedup_index is not None or self._table_format() != "parquet"
+        ):
+            logger.warning(
+                "DuckDB - single pass is not possible with a dedup index or a Delta "
+                "table, transforming {} in stages",
+                process_date,
+            )
+        elif single_pass:
+            self._copy_clean_data_to_parquet(
+                source_path, target_path, projected, writer_profile
+            )
+            self._remove_stale_partition_files(silver_bucket, [process_date])
+            self._record_silver_hours(silver_bucket, [process_date])
+            return
+
+        if projected:
+            self._serialize_projected_data(source_path)
+            self._clean_data(source_table="gharchive_projected")
+        else:
+            self._serialize_data(source_path)
+            self._clean_data()
+
+        if self.dedup_index is None:
+            self._write_clean_hour(target_path, process_date, writer_profile)
+        else:
+            self._write_deduplicated(
+                "gharchive_clean",
+                f"TIMESTAMP '{process_date:%Y-%m-%d %H}:00:00'",
+                [process_date],
+                lambda: self._write_clean_hour(
+                    target_path, process_date, writer_profile
+                ),
+            )
+        self._remove_stale_partition_files(silver_bucket, [process_date])
+        self._record_silver_hours(silver_bucket, [process_date])
+
+    def _write_clean_hour(
+        self, target_path: str, process_date: datetime, writer_profile: str
+    ):
+        if self._table_format() == "parquet":
+            self._write_data_to_parquet(
+                target_path,
+                duckdb_table="gharchive_clean",
+                writer_profile=writer_profile,
+            )
+            return
+
+        day, hour = process_date.strftime("%Y-%m-%d"), process_date.strftime("%H")
+        self._write_delta(
+            "silver",
+            f"SELECT *, '{day}' AS date, '{hour}' AS hour FROM gharchive_clean",
+            ["date", "hour"],
+            f"date = '{day}' AND hour = '{hour}'",
+            writer_profile,
+        )
+
+    def _write_deduplicated(
+        self, table: str, hour_expression: str, hours: list[datetime], write
+    ):
+        """
+        Drops the events of table seen before, records the others and calls write.
+
+        The index is only locked while checking and recording the ids, not through
+        the write to silver; the previous ids of hours are put back if write fails.
+
+        :param hour_expression: SQL expression of the hour of an event of table
+        :return: what write returns
+        """
+        with self.dedup_index.attach(self.con):
+            self._drop_seen_events(table, hours)
+            self.dedup_index.record(self.con, table, hour_expression, hours)
+        try:
+            result = write()
+        except BaseException:
+            with self.dedup_index.attach(self.con):
+                self.dedup_index.restore(self.con, hours)
+            raise
+        self.dedup_index.release(self.con)
+        return result
+
+    def _drop_seen_events(self, table: str, hours: list[datetime]):
+        with self.instrumentation.stage("dedup", source=table) as record:
+            record["rows_in"] = self.con.execute(
+                f"SELECT count(*) FROM {table}"
+            ).fetchone()[0]
+            record["rows_dropped"] = self.dedup_index.drop_seen(self.con, table, hours)
+            record["rows_out"] = record["rows_in"] - record["rows_dropped"]
+
+    def transform_range(
+        self, start_date: datetime, end_date: datetime, projected: bool = True
+    ) -> int:
+        """
+        Transform every bronze hour between start_date and end_date (both inclusive) in one query.
+
+        All the hours are scanned together by DuckDB's multi-threaded reader. In the hive
+        layout the silver files are written by a single COPY ... PARTITION_BY (date, hour);
+        the legacy layout has no partition directories, so the cleaned hours are staged
+        in a temp table and copied out per hour. With a dedup index the hours are always
+        staged, to drop the events seen before writing, and a Delta table replaces all
+        the hours in one commit. Missing hours are skipped.
+
+        :param start_date: first hour to transform
+        :param end_date: last hour to transform, inclusive
+        :param projected: read only the columns kept by the clean step
+        :return: the number of hours written
+        """
+        bronze_bucket = self.config.get("datalake", "bronze_bucket")
+        silver_bucket = self.config.get("datalake", "silver_bucket")
+        writer_profile = self._writer_profile("silver")
+
+        start_date = start_date.replace(minute=0, second=0, microsecond=0)
+        end_date = end_date.replace(minute=0, second=0, microsecond=0)
+        hours = []
+        process_date = start_date
+        while process_date <= end_date:
+            hours.append(process_date)
+            process_date += timedelta(hours=1)
+
+        files = self._bronze_files(bronze_bucket, hours)
+        if not files:
+            raise FileNotFoundError(
+                f"No bronze hours between {start_date} and {end_date}"
+            )
+        range_hours = [
+            datetime.strptime(hour, "%Y-%m-%d-%H")
+            for hour in sorted(
+                {re.search(BRONZE_HOUR_PATTERN, file).group(1) for file in files}
+            )
+        ]
+        hours_found = len(range_hours)
+        logger.info(
+            "DuckDB - transforming {} of {} hours in one pass...",
+            hours_found,
+            len(hours),
+        )
+
+        # the hour comes from the bronze file name, like the single hour transform
+        source_hour = (
+            f"strptime(regexp_extract(filename, '{BRONZE_HOUR_PATTERN}', 1), "
+            "'%Y-%m-%d-%H')"
+        )
+        query = self._clean_query(
+            self._read_json(files, projected, filename=True),
+            extra_columns=[
+                f"strftime({source_hour}, '%Y-%m-%d') AS date",
+                f"strftime({source_hour}, '%H') AS hour",
+            ],
+        )
+
+        with self.instrumentation.stage(
+            "transform_range",
+            hours=hours_found,
+            writer_profile=writer_profile,
+        ) as record:
+            record["bytes_in"] = self.con.execute(
+                f"SELECT sum(size) FROM read_blob({files})"
+            ).fetchone()[0]
+
+            if (
+                self._silver_layout_is_hive()
+                and self.dedup_index is None
+                and self._table_format() == "parquet"
+            ):
+                target_path = f"s3://{silver_bucket}/{self.dataset_base_path}"
+                self._allow_open_partitions(hours_found)
+                record["rows_out"] = self._execute_stage(
+                    record,
+                    self._copy_to_parquet(
+                        query,
+                        target_path,
+                        writer_profile,
+                        partition_by=["date", "hour"],
+                    ),
+                )
+                written = [
+                    self._build_silver_path(silver_bucket, hour) for hour in range_hours
+                ]
+                self._count_unknown_event_types(f"read_parquet({written})", record)
+            else:
+                self.con.execute(
+                    f"CREATE OR REPLACE TEMP TABLE gharchive_clean_range AS FROM ({query})"
+                )
+                self._count_unknown_event_types("gharchive_clean_range", record)
+                if self.dedup_index is None:
+                    record["rows_out"] = self._write_range(
+                        "gharchive_clean_range",
+                        silver_bucket,
+                        writer_profile,
+                        range_hours,
+                    )
+                else:
+                    record["rows_out"] = self._write_deduplicated(
+                        "gharchive_clean_range",
+                        "strptime(date || '-' || hour, '%Y-%m-%d-%H')",
+                        range_hours,
+                        lambda: self._write_range(
+                            "gharchive_clean_range",
+                            silver_bucket,
+                            writer_profile,
+                            range_hours,
+                        ),
+                    )
+                self.con.execute("DROP TABLE gharchive_clean_range")
+
+        self._remove_stale_partition_files(silver_bucket, range_hours)
+        self._record_silver_hours(silver_bucket, range_hours)
+        logger.success("DuckDB - {} hours transformed", hours_found)
+        return hours_found
+
+    def _write_range(
+        self,
+        table: str,
+        silver_bucket: str,
+        writer_profile: str,
+        hours: list[datetime],
+    ) -> int:
+        """Writes the cleaned hours of table, with date and hour columns, to silver."""
+        if self._table_format() == "delta":
+            return self._write_delta(
+                "silver",
+                f"FROM {table}",
+                ["date", "hour"],
+                " OR ".join(
+                    f"(date = '{hour:%Y-%m-%d}' AND hour = '{hour:%H}')"
+                    for hour in hours
+                ),
+                writer_profile,
+            )
+
+        if self._silver_layout_is_hive():
+            self._allow_open_partitions(len(hours))
+            return self.con.execute(
+                self._copy_to_parquet(
+                    f"FROM {table}",
+                    f"s3://{silver_bucket}/{self.dataset_base_path}",
+                    writer_profile,
+                    partition_by=["date", "hour"],
+                )
+            ).fetchone()[0]
+
+        rows_out = 0
+        for day, hour in self.con.execute(
+            f"SELECT DISTINCT date, hour FROM {table} ORDER BY ALL"
+        ).fetchall():
+            target_path = self._build_silver_path(
+                silver_bucket, datetime.strptime(f"{day}-{hour}", "%Y-%m-%d-%H")
+            )
+            rows_out += self.con.execute(
+                self._copy_to_parquet(
+                    f"""SELECT * EXCLUDE (date, hour) FROM {table}
+                    WHERE date = '{day}' AND hour = '{hour}'""",
+                    target_path,
+                    writer_profile,
+                )
+            ).fetchone()[0]
+        return rows_out
+
+    def _read_json_projected(
+        self, source_path: str | list[str], filename: bool = False
+    ) -> str:
+        files = f"'{source_path}'" if isinstance(source_path, str) else source_path
+        columns = ", ".join(
+            f"'{name}': '{dtype}'"
+            for name, dtype in GHARCHIVE_PROJECTED_COLUMNS.items()
+        )
+        return f"""read_json({files},
+                         format='newline_delimited',
+                         columns={{{columns}}},
+                         filename={str(filename).lower()},
+                         ignore_errors=true)"""
+
+    def _read_json(
+        self, source_path: str | list[str], projected: bool, filename: bool = False
+    ) -> str:
+        """
+        FROM clause reading raw hours, filename adds the source file as a column.
+
+        Without projection every column is read, with the registered schema when there
+        is a registry and with per-file inference otherwise.
+        """
+        if projected:
+            return self._read_json_projected(source_path, filename)
+        files = f"'{source_path}'" if isinstance(source_path, str) else source_path
+        if self.schema_registry is None:
+            return f"read_json_auto({files}, filename={str(filename).lower()}, ignore_errors=true)"
+
+        columns = ", ".join(
+            f"'{name}': '{dtype}'"
+            for name, dtype in self.schema_registry.columns(self.con, files).items()
+        )
+        return f"""read_json({files},
+                         format='newline_delimited',
+                         columns={{{columns}}},
+                         filename={str(filename).lower()},
+                         ignore_errors=true)"""
+
+    def _serialize_projected_data(self, source_path: str | list[str]):
+        logger.info("DuckDB - serializing projected data...")
+        # a view: the file is read, and measured, by the clean stage
         self.con.execute(f"""
-                         create or replace table gharchive_raw as 
-                         from read_json_auto('{source_path}', ignore_errors=true)
+                         create or replace temp view gharchive_projected as
+                         from {self._read_json_projected(source_path)}
                          """)
+        logger.success("DuckDB - projected data serialized")
+
+    def _serialize_data(self, source_path: str | list[str]):
+        logger.info("DuckDB - serializing data...")
+        with self.instrumentation.stage("serialize", source=source_path) as record:
+            record["bytes_in"] = self._file_size(source_path)
+            record["rows_out"] = self._execute_stage(
+                record,
+                f"""
+                         create or replace temp table gharchive_raw as 
+                         from {self._read_json(source_path, projected=False)}
+                         """,
+            )
         logger.success("DuckDB - data serialized")
 
-    def _clean_data(self):
-        logger.info("DuckDB - cleaning data...")
-        query = """
+    def _clean_query(self, source: str, extra_columns: list[str] = ()) -> str:
+        """
+        :param extra_columns: SQL expressions selected after the silver columns
+        """
+        extra = "".join(f",\n            {column}" for column in extra_columns)
+        # typed once here, so that readers of silver never have to cast
+        return f"""
             SELECT 
-            id AS "event_id",
-            actor.id AS "user_id",
+            CAST(id AS BIGINT) AS "event_id",
+            CAST(actor.id AS BIGINT) AS "user_id",
             actor.login AS "user_name",
             actor.display_login AS "user_display_name",
-            type AS "event_type",
-            repo.id AS "repo_id",
+            CAST(type AS VARCHAR) AS "event_type",
+            CAST(repo.id AS BIGINT) AS "repo_id",
             repo.name AS "repo_name",
             repo.url AS "repo_url",
-            created_at AS "event_date"
-            FROM 'gharchive_raw'
+            CAST(created_at AS TIMESTAMP) AS "event_date"{extra}
+            FROM {source}
         """
-        self.con.execute(f"CREATE OR REPLACE TABLE gharchive_clean AS FROM ({query})")
+
+    def _count_unknown_event_types(self, source: str, record: dict):
+        """Count the events of source whose type is not in GITHUB_EVENT_TYPES."""
+        unknown = dict(
+            self.con.execute(f"""
+                SELECT event_type, count(*) FROM {source}
+                WHERE event_type NOT IN {GITHUB_EVENT_TYPES}
+                GROUP BY ALL
+            """).fetchall()
+        )
+        if unknown:
+            record["unknown_event_types"] = unknown
+            logger.warning("DuckDB - events of unknown types kept: {}", unknown)
+
+    def _clean_data(self, source_table: str = "gharchive_raw"):
+        logger.info("DuckDB - cleaning data...")
+        query = self._clean_query(f"'{source_table}'")
+        with self.instrumentation.stage("clean", source=source_table) as record:
+            record["rows_out"] = self._execute_stage(
+                record,
+                f"CREATE OR REPLACE TEMP TABLE gharchive_clean AS FROM ({query})",
+            )
+            self._count_unknown_event_types("gharchive_clean", record)
         logger.success("DuckDB - data cleaned")
 
-    def _write_data_to_parquet(self, target_path: str, duckdb_table: str):
+    def _copy_clean_data_to_parquet(
+        self,
+        source_path: str | list[str],
+        target_path: str,
+        projected: bool = False,
+        writer_profile: str = "default",
+    ):
+        """Serialize, clean and write in one statement so DuckDB can pipeline it."""
+        logger.info("DuckDB - copying cleaned data to parquet in a single pass...")
+        query = self._clean_query(self._read_json(source_path, projected))
+        with self.instrumentation.stage(
+            "serialize_clean_write",
+            source=source_path,
+            target=target_path,
+            writer_profile=writer_profile,
+        ) as record:
+            record["bytes_in"] = self._file_size(source_path)
+            record["rows_out"] = self._execute_stage(
+                record, self._copy_to_parquet(query, target_path, writer_profile)
+            )
+            record["bytes_out"] = self._file_size(target_path)
+            # only the event_type column of the written file is read
+            self._count_unknown_event_types(f"'{target_path}'", record)
+        logger.success("DuckDB - cleaned data copied to parquet")
+
+    def _write_data_to_parquet(
+        self, target_path: str, duckdb_table: str, writer_profile: str = "default"
+    ):
         logger.info("DuckDB - writing cleaned data to parquet...")
-        result_table = self.con.table(f"{duckdb_table}")
-        result_table.write_parquet(target_path)
+        with self.instrumentation.stage(
+            "write",
+            source=duckdb_table,
+            target=target_path,
+            writer_profile=writer_profile,
+        ) as record:
+            record["rows_out"] = self._execute_stage(
+                record,
+                self._copy_to_parquet(
+                    f"FROM {duckdb_table}", target_path, writer_profile
+                ),
+            )
+            record["bytes_out"] = self._file_size(target_path)
         logger.success("DuckDB - cleaned data written to parquet")
 
-    def aggregate_silver_data(self, process_date: datetime):
+    def aggregate_silver_data(self, process_date: datetime, incremental: bool = False):
         """
         Aggregate raw data and export to parquet format.
 
         :param process_date: the process date corresponding to the daily partition to aggregate
+        :param incremental: fold only the silver hours not yet aggregated into the daily gold file;
+            a Delta gold table always aggregates the whole day
         """
         try:
-            source_bucket = self.config.get("datalake", "silver_bucket")
             sink_bucket = self.config.get("datalake", "gold_bucket")
 
             year_month_day = process_date.strftime("%Y-%m-%d")
 
-            source_path = f"s3://{source_bucket}/{self.dataset_base_path}/{year_month_day}/*/*.parquet"
             target_path = f"s3://{sink_bucket}/{self.dataset_base_path}/{year_month_day}/{year_month_day}.parquet"
 
-            self._aggregate_data(source_path)
-            self._write_data_to_parquet(target_path, duckdb_table="gharchive_agg")
+            if self._table_format() == "delta":
+                source = self._silver_source(process_date, process_date)
+                self._aggregate_data(source)
+                if self._gold_model() == "star":
+                    self._write_repo_versions(
+                        self._repo_versions_query("gharchive_repo_agg"), process_date
+                    )
+                if self._sketches_enabled():
+                    self._write_sketches(source, process_date)
+                self._write_delta(
+                    "gold",
+                    f"SELECT *, '{year_month_day}' AS date FROM gharchive_agg",
+                    ["date"],
+                    f"date = '{year_month_day}'",
+                    self._writer_profile("gold"),
+                )
+            elif incremental:
+                state_path = f"s3://{sink_bucket}/{self.dataset_base_path}/{year_month_day}/_incremental"
+                self._aggregate_new_hours(
+                    self._silver_files(process_date, process_date),
+                    target_path,
+                    state_path,
+                    process_date,
+                )
+            else:
+                source = self._silver_source(process_date, process_date)
+                self._aggregate_data(source)
+                if self._gold_model() == "star":
+                    self._write_repo_versions(
+                        self._repo_versions_query("gharchive_repo_agg"), process_date
+                    )
+                if self._sketches_enabled():
+                    self._write_sketches(source, process_date)
+                self._write_data_to_parquet(
+                    target_path,
+                    duckdb_table="gharchive_agg",
+                    writer_profile=self._writer_profile("gold"),
+                )
+            self._record_in_catalog(
+                "gold",
+                target_path,
+                process_date.replace(hour=0, minute=0, second=0, microsecond=0),
+            )
 
         except Exception as e:
-            logger.error(f"Error in aggregate_silver_data: {str(e)}")
+            logger.error(f"Error in aggregate_silver_data: {e!s}")
 
-    def _aggregate_data(self, source_path: str):
-        logger.info("DuckDB - aggregating data...")
-        query = f"""
+    def _gold_model(self) -> str:
+        """
+        [datalake] gold_model: wide keeps repo_name and repo_url in the gold rows, star
+        keys them on repo_id only and keeps the names in the repo dimension.
+        """
+        gold_model = self.config.get("datalake", "gold_model", fallback="wide")
+        if gold_model not in ("wide", "star"):
+            raise ValueError(
+                f"Unknown gold model {gold_model!r}, expected wide or star"
+            )
+        return gold_model
+
+    def _aggregate_query(self, source: str) -> str:
+        # the long repo strings are left to the dimension, the hash table only holds ids
+        repo_columns = "" if self._gold_model() == "star" else "repo_name, repo_url,"
+        return f"""
             SELECT 
             event_type,
             repo_id,
-            repo_name,
-            repo_url,
-            DATE_TRUNC('day',CAST(event_date AS TIMESTAMP)) AS event_date,
+            {repo_columns}
+            DATE_TRUNC('day', event_date) AS event_date,
             count(*) AS event_count
-            FROM '{source_path}'
+            FROM {source}
             GROUP BY ALL
         """
-        self.con.execute(f"CREATE OR REPLACE TABLE gharchive_agg AS FROM ({query})")
+
+    def _listed_files(self, directory: str) -> list[str]:
+        # listed, an exact path glob does not tell whether the file exists
+        return [
+            row[0]
+            for row in self.con.execute(
+                f"SELECT file FROM glob('{directory}/*.parquet')"
+            ).fetchall()
+        ]
+
+    def _repo_dimension_directory(self) -> str:
+        gold_bucket = self.config.get("datalake", "gold_bucket")
+        return f"s3://{gold_bucket}/{self.dataset_base_path}/dim_repo"
+
+    def _daily_repo_version_files(self) -> list[str]:
+        return [
+            file
+            for file in self._listed_files(self._repo_dimension_directory())
+            if re.search(r"/\d{4}-\d{2}-\d{2}\.parquet$", file)
+        ]
+
+    def _repo_versions_query(self, source: str) -> str:
+        """The repository versions of the events of source, from their first event."""
+        return f"""
+            SELECT repo_id, repo_name, repo_url, min(event_date) AS valid_from
+            FROM {source}
+            GROUP BY ALL
+        """
+
+    def _write_repo_versions(
+        self, versions: str, process_date: datetime, merge: bool = False
+    ):
+        """
+        Write the repository versions of a day to the day's file of the repo dimension.
+
+        Each day has its own file, dim_repo/YYYY-MM-DD.parquet, so an aggregation
+        writes the repositories of its day only and aggregations of different days
+        do not share a file. Readers collapse the files into the dimension, see
+        _repo_dimension_query. Aggregations of the same day must not run at once.
+
+        :param versions: query of the (repo_id, repo_name, repo_url, valid_from) of the day
+        :param merge: versions only holds the new hours of the day, add them to its file
+        """
+        directory = self._repo_dimension_directory()
+        target_path = f"{directory}/{process_date:%Y-%m-%d}.parquet"
+        if merge and target_path in self._listed_files(directory):
+            versions = f"""
+                SELECT repo_id, repo_name, repo_url, min(valid_from) AS valid_from
+                FROM (
+                    {versions}
+                    UNION ALL
+                    SELECT repo_id, repo_name, repo_url, valid_from
+                    FROM read_parquet('{target_path}')
+                )
+                GROUP BY ALL
+            """
+
+        logger.info("DuckDB - writing the repo versions of the day...")
+        with self.instrumentation.stage("repo_dimension", target=target_path) as record:
+            # staged, a merged file is read and rewritten
+            record["rows_out"] = self._execute_stage(
+                record, f"CREATE OR REPLACE TEMP TABLE repo_versions AS {versions}"
+            )
+            self.con.execute(
+                self._copy_to_parquet(
+                    "FROM repo_versions",
+                    target_path,
+                    self._writer_profile("gold"),
+                    sort_by=["repo_id", "valid_from"],
+                )
+            )
+        logger.success("DuckDB - repo versions written")
+
+    def _collapse_repo_versions(self, files: list[str]) -> str:
+        """
+        Query of the repo dimension rows of the versions stored in files.
+
+        The dimension keeps every version of a repository (slowly changing, type 2):
+        a version is valid from the first event that carries it until the next
+        version starts, valid_to is NULL for the current one. A version equal to the
+        one before it, e.g. seen again on a later day, is dropped.
+        """
+        return f"""
+            SELECT
+            repo_id,
+            repo_name,
+            repo_url,
+            valid_from,
+            lead(valid_from) OVER (PARTITION BY repo_id ORDER BY valid_from) AS valid_to
+            FROM (
+                SELECT repo_id, repo_name, repo_url, valid_from
+                FROM read_parquet({files}, union_by_name = true)
+                QUALIFY (repo_name, repo_url) IS DISTINCT FROM lag((repo_name, repo_url))
+                    OVER (PARTITION BY repo_id ORDER BY valid_from, repo_name, repo_url)
+            )
+        """
+
+    def _repo_dimension_query(self) -> str:
+        """
+        Query of the repo dimension, from its latest compacted file and the daily
+        files of the days after it.
+        """
+        directory = self._repo_dimension_directory()
+        files = self._daily_repo_version_files()
+        compacted = self._listed_files(f"{directory}/_compacted")
+        if compacted:
+            # named after the last day it holds
+            latest = max(compacted)
+            files = [latest] + [
+                file for file in files if Path(file).stem > Path(latest).stem
+            ]
+        if not files:
+            raise FileNotFoundError("No repo dimension, aggregate a day first")
+        return self._collapse_repo_versions(files)
+
+    def compact_repo_dimension(self) -> str:
+        """
+        Collapse the daily files of the repo dimension into one compacted file.
+
+        Readers then open the compacted file and the daily files of the days after
+        it, instead of a file per day ever aggregated. The daily files are left in
+        place; a day aggregated again afterwards is only read once the dimension is
+        compacted again.
+
+        :return: the path of the compacted file
+        """
+        files = self._daily_repo_version_files()
+        if not files:
+            raise FileNotFoundError("No repo dimension files to compact")
+        through = max(Path(file).stem for file in files)
+        target_path = f"{self._repo_dimension_directory()}/_compacted/{through}.parquet"
+
+        logger.info("DuckDB - compacting {} repo dimension files...", len(files))
+        with self.instrumentation.stage(
+            "compact_repo_dimension", source=f"{len(files)} files", target=target_path
+        ) as record:
+            record["rows_out"] = self._execute_stage(
+                record,
+                self._copy_to_parquet(
+                    self._collapse_repo_versions(files),
+                    target_path,
+                    self._writer_profile("gold"),
+                    sort_by=["repo_id", "valid_from"],
+                ),
+            )
+        logger.success("DuckDB - repo dimension compacted into {}", target_path)
+        return target_path
+
+    def read_gold(
+        self, start_date: datetime, end_date: datetime
+    ) -> duckdb.DuckDBPyRelation:
+        """
+        Relation over the gold rows between start_date and end_date, by day.
+
+        In the star model the repo_name and repo_url of each row are those of the repo
+        dimension version current at the end of its day.
+
+        :param start_date: first day to read
+        :param end_date: last day to read, inclusive
+        """
+        if self._table_format() == "delta":
+            files = delta_tables.snapshot_files(
+                self.con,
+                self._delta_uri("gold"),
+                delta_tables.storage_options(self.config),
+                f""""partition.date" BETWEEN '{start_date:%Y-%m-%d}' AND '{end_date:%Y-%m-%d}'""",
+            )
+        else:
+            gold_bucket = self.config.get("datalake", "gold_bucket")
+            days = []
+            day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+            while day <= end_date:
+                days.append(
+                    f"s3://{gold_bucket}/{self.dataset_base_path}/{day:%Y-%m-%d}/*.parquet"
+                )
+                day += timedelta(days=1)
+            files = [
+                row[0]
+                for row in self.con.execute(
+                    f"SELECT file FROM glob({days}) ORDER BY file"
+                ).fetchall()
+            ]
+        if not files:
+            raise FileNotFoundError(
+                f"No gold files between {start_date:%Y-%m-%d} and {end_date:%Y-%m-%d}"
+            )
+        if self._gold_model() == "wide":
+            return self.con.sql(f"SELECT * FROM read_parquet({files})")
+
+        return self.con.sql(f"""
+            SELECT fact.*, dim.repo_name, dim.repo_url
+            FROM read_parquet({files}) AS fact
+            ASOF LEFT JOIN ({self._repo_dimension_query()}) AS dim
+            ON fact.repo_id = dim.repo_id
+            AND fact.event_date + INTERVAL 1 DAY > dim.valid_from
+        """)
+
+    def _sketches_enabled(self) -> bool:
+        return self.config.getboolean("datalake", "sketches", fallback=False)
+
+    def _sketch_directory(self, process_date: datetime) -> str:
+        gold_bucket = self.config.get("datalake", "gold_bucket")
+        return f"s3://{gold_bucket}/{self.dataset_base_path}/_sketches/{process_date:%Y-%m-%d}"
+
+    def _write_sketches(self, source: str, process_date: datetime, merge: bool = False):
+        """
+        Write the distinct user registers of source and the top repos of gharchive_agg.
+
+        :param source: the silver events of the day
+        :param merge: source only holds the new hours of the day, merge its registers
+            with those already written, which must exist
+        """
+        directory = self._sketch_directory(process_date)
+        registers_path = f"{directory}/distinct_users.parquet"
+        registers = gold_sketches.registers_query(
+            source,
+            self.config.getint(
+                "datalake", "hll_precision", fallback=gold_sketches.DEFAULT_PRECISION
+            ),
+        )
+        if merge:
+            registers = gold_sketches.merge_registers_query(
+                [f"({registers})", f"'{registers_path}'"], ["repo_id"]
+            )
+        capacity = self.config.getint(
+            "datalake", "top_repos", fallback=gold_sketches.DEFAULT_CAPACITY
+        )
+
+        logger.info("DuckDB - writing the sketches of the day...")
+        with self.instrumentation.stage("sketches", target=directory) as record:
+            # staged, merged registers are read and rewritten
+            record["rows_out"] = self._execute_stage(
+                record,
+                f"CREATE OR REPLACE TEMP TABLE distinct_users AS FROM ({registers})",
+            )
+            self.con.execute(
+                self._copy_to_parquet(
+                    "FROM distinct_users",
+                    registers_path,
+                    self._writer_profile("gold"),
+                    sort_by=["repo_id", "register"],
+                )
+            )
+            self.con.execute(
+                self._copy_to_parquet(
+                    gold_sketches.top_repos_query("gharchive_agg", capacity),
+                    f"{directory}/top_repos.parquet",
+                    self._writer_profile("gold"),
+                    sort_by=["event_type", "event_count DESC"],
+                )
+            )
+        logger.success("DuckDB - sketches written")
+
+    def _sketch_files(
+        self, name: str, start_date: datetime, end_date: datetime
+    ) -> list[str]:
+        patterns = []
+        day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day <= end_date:
+            patterns.append(f"{self._sketch_directory(day)}/*.parquet")
+            day += timedelta(days=1)
+        files = [
+            row[0]
+            for row in self.con.execute(
+                f"SELECT file FROM glob({patterns}) WHERE file LIKE '%/{name}.parquet' ORDER BY file"
+            ).fetchall()
+        ]
+        if not files:
+            raise FileNotFoundError(
+                f"No {name} sketches between {start_date:%Y-%m-%d} and {end_date:%Y-%m-%d}"
+            )
+        return files
+
+    def distinct_users(
+        self, start_date: datetime, end_date: datetime, by_repo: bool = True
+    ) -> duckdb.DuckDBPyRelation:
+        """
+        Estimated distinct users between start_date and end_date, merged from the sketches.
+
+        :param start_date: first day
+        :param end_date: last day, inclusive
+        :param by_repo: per repo_id, or one count for all repos
+        """
+        source = f"read_parquet({self._sketch_files('distinct_users', start_date, end_date)})"
+        if (
+            self.con.execute(
+                f"SELECT count(DISTINCT precision) FROM {source}"
+            ).fetchone()[0]
+            > 1
+        ):
+            raise ValueError(
+                "The distinct_users sketches of these days have different precisions"
+            )
+        group_by = ["repo_id"] if by_repo else []
+        return self.con.sql(
+            gold_sketches.estimate_query(
+                f"({gold_sketches.merge_registers_query([source], group_by)})",
+                group_by,
+            )
+        )
+
+    def top_repos(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        k: int = 10,
+        event_type: str | None = None,
+    ) -> duckdb.DuckDBPyRelation:
+        """
+        The k busiest repos between start_date and end_date, merged from the sketches.
+
+        event_count is a lower bound of the count of each repo and max_event_count an
+        upper bound; they are equal for a repo kept by the sketch of every day. k
+        should not exceed [datalake] top_repos.
+
+        :param start_date: first day
+        :param end_date: last day, inclusive
+        :param event_type: count this event type only, all events when None
+        """
+        files = self._sketch_files("top_repos", start_date, end_date)
+        return self.con.sql(
+            gold_sketches.merge_top_repos_query(
+                f"read_parquet({files}, filename = true)", k, event_type
+            )
+        )
+
+    def _aggregate_data(self, source: str):
+        """
+        Aggregate source into gharchive_agg.
+
+        In the star model the rows are first aggregated with the repo names and urls,
+        and their first event, into gharchive_repo_agg, which the versions of the
+        repo dimension are taken from without scanning source again.
+        """
+        logger.info("DuckDB - aggregating data...")
+        query = self._aggregate_query(source)
+        with self.instrumentation.stage("aggregate") as record:
+            # parquet row counts come from the footers, the data is not scanned
+            record["rows_in"] = self.con.execute(
+                f"SELECT count(*) FROM {source}"
+            ).fetchone()[0]
+            if self._gold_model() == "star":
+                self.con.execute(f"""
+                    CREATE OR REPLACE TEMP TABLE gharchive_repo_agg AS
+                    SELECT
+                    event_type,
+                    repo_id,
+                    repo_name,
+                    repo_url,
+                    DATE_TRUNC('day', event_date) AS day,
+                    count(*) AS event_count,
+                    min(event_date) AS event_date
+                    FROM {source}
+                    GROUP BY ALL
+                """)
+                query = """
+                    SELECT
+                    event_type,
+                    repo_id,
+                    day AS event_date,
+                    CAST(sum(event_count) AS BIGINT) AS event_count
+                    FROM gharchive_repo_agg
+                    GROUP BY ALL
+                """
+            record["rows_out"] = self._execute_stage(
+                record, f"CREATE OR REPLACE TEMP TABLE gharchive_agg AS FROM ({query})"
+            )
         logger.success("DuckDB - data aggregated")
+
+    def _partial_path(self, state_path: str, source_file: str) -> str:
+        # named after the silver file, e.g. 03-2024-10-10-03.parquet or hour=03-data_0.parquet
+        source = Path(source_file)
+        return f"{state_path}/{source.parent.name}-{source.stem}.parquet"
+
+    def _aggregate_new_hours(
+        self,
+        source_files: list[str],
+        target_path: str,
+        state_path: str,
+        process_date: datetime,
+    ):
+        """
+        Aggregate the silver hours missing from the manifest into the daily gold file.
+
+        Each new hour is aggregated on its own into a partial file next to the
+        manifest, and the gold file is rebuilt as the sum of the partials of the
+        day's silver files, so a run costs one hour instead of a day. The manifest
+        lists the silver files by path, size and modification time: a re-transformed
+        hour is aggregated again, and a run that failed before writing the manifest
+        only repeats its partials. The distinct user sketch of the day is merged
+        with the registers of the new hours.
+        """
+        manifest_path = f"{state_path}/manifest.parquet"
+        if not source_files:
+            logger.info("DuckDB - no silver hours to aggregate")
+            return
+
+        self.con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE silver_files AS
+            SELECT filename AS source_file, size, last_modified
+            FROM read_blob({source_files})
+        """)
+        new_files_query = "SELECT source_file FROM silver_files"
+        folded = 0
+        if manifest_path in self._listed_files(state_path):
+            manifest = self.con.sql(f"FROM '{manifest_path}'")
+            # manifests listing paths only are rebuilt from all the hours
+            if "size" in manifest.columns:
+                folded = manifest.aggregate("count(*)").fetchone()[0]
+                new_files_query += f" ANTI JOIN '{manifest_path}' USING (source_file, size, last_modified)"
+        new_files = [
+            row[0]
+            for row in self.con.sql(
+                f"{new_files_query} ORDER BY source_file"
+            ).fetchall()
+        ]
+        if not new_files and len(source_files) == folded:
+            logger.info("DuckDB - no new silver hours to aggregate")
+            return
+
+        logger.info("DuckDB - aggregating {} new silver hours...", len(new_files))
+        for source_file in new_files:
+            query = self._aggregate_query(f"'{source_file}'")
+            self.con.execute(
+                f"COPY ({query}) TO '{self._partial_path(state_path, source_file)}' (FORMAT PARQUET)"
+            )
+
+        partial_paths = [
+            self._partial_path(state_path, source_file) for source_file in source_files
+        ]
+        self.con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE gharchive_agg AS
+            SELECT
+            * EXCLUDE (event_count),
+            CAST(sum(event_count) AS BIGINT) AS event_count
+            FROM read_parquet({partial_paths})
+            GROUP BY ALL
+        """)
+        self._write_data_to_parquet(
+            target_path,
+            duckdb_table="gharchive_agg",
+            writer_profile=self._writer_profile("gold"),
+        )
+        new_hours = f"read_parquet({new_files}, union_by_name = true)"
+        if self._gold_model() == "star":
+            versions_path = (
+                f"{self._repo_dimension_directory()}/{process_date:%Y-%m-%d}.parquet"
+            )
+            if folded and versions_path in self._daily_repo_version_files():
+                self._write_repo_versions(
+                    self._repo_versions_query(new_hours), process_date, merge=True
+                )
+            else:
+                # also when the file of the day is missing, the day is read again
+                self._write_repo_versions(
+                    self._repo_versions_query(
+                        f"read_parquet({source_files}, union_by_name = true)"
+                    ),
+                    process_date,
+                )
+        if self._sketches_enabled():
+            sketch_directory = self._sketch_directory(process_date)
+            if (
+                folded
+                and f"{sketch_directory}/distinct_users.parquet"
+                in self._listed_files(sketch_directory)
+            ):
+                self._write_sketches(new_hours, process_date, merge=True)
+            else:
+                # the registers of the folded hours are missing, the day is read again
+                self._write_sketches(
+                    f"read_parquet({source_files}, union_by_name = true)", process_date
+                )
+
+        self.con.execute(f"COPY silver_files TO '{manifest_path}' (FORMAT PARQUET)")
+        logger.success("DuckDB - {} new silver hours aggregated", len(new_files))
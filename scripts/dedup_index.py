@@ -0,0 +1,148 @@
+"""Persistent index of the event ids already written to silver.
+
+GH Archive hours overlap and sometimes repeat an event, and the gold counts are a
+plain count(*). Instead of re-scanning the silver day to drop repeats, the ids
+each hour wrote are kept in a local DuckDB database:
+
+    event_ids(event_id BIGINT, hour TIMESTAMP)
+
+Rows are appended in event_id order, and event ids grow with time, so the
+min/max statistics of the index row groups are narrow: looking up the ids of an
+hour only reads the row groups within that hour's id range, whatever the size
+of the index. An hour is checked against the ids of every other hour, so
+re-transforming it replaces its own ids instead of dropping all its events.
+
+A DuckDB database has a single writer; processes sharing an index take turns
+through a lock file next to it. The ids of an hour are recorded before it is
+written to silver, so the lock is not held through the write; the ids the hour
+had before are kept aside and put back if the write fails, as the silver files
+they came from are still there.
+"""
+
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+from loguru import logger
+
+INDEX_ALIAS = "dedup_index"
+# temp table of the ids recorded hours had before, until their write succeeds
+PREVIOUS_IDS = "dedup_previous_ids"
+
+
+def _hour_literals(hours: list[datetime]) -> str:
+    return ", ".join(f"TIMESTAMP '{hour:%Y-%m-%d %H}:00:00'" for hour in hours)
+
+
+class DedupIndex:
+    def __init__(self, path: Path):
+        """
+        :param path: the DuckDB database file of the index, created when missing
+        """
+        self.path = path
+
+    @contextmanager
+    def attach(self, con: duckdb.DuckDBPyConnection):
+        """Attaches the index to con as dedup_index, holding the lock meanwhile."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            con.execute(f"ATTACH '{self.path}' AS {INDEX_ALIAS}")
+            try:
+                con.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {INDEX_ALIAS}.event_ids (
+                        event_id BIGINT,
+                        hour TIMESTAMP
+                    )
+                """)
+                yield
+            finally:
+                con.execute(f"DETACH {INDEX_ALIAS}")
+
+    def drop_seen(
+        self, con: duckdb.DuckDBPyConnection, table: str, hours: list[datetime]
+    ) -> int:
+        """
+        Deletes from table the repeated events and those other hours already wrote.
+
+        Of events repeated within table the earliest is kept. Must run inside attach.
+
+        :param hours: the hours table belongs to
+        :return: the number of rows deleted
+        """
+        rows_in = con.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {table} AS
+            FROM {table}
+            QUALIFY row_number() OVER (PARTITION BY event_id ORDER BY event_date) = 1
+        """)
+
+        low, high = con.execute(
+            f"SELECT min(event_id), max(event_id) FROM {table}"
+        ).fetchone()
+        if low is not None:
+            # the range filter is what lets the index skip its other row groups
+            con.execute(f"""
+                DELETE FROM {table}
+                WHERE event_id IN (
+                    SELECT event_id FROM {INDEX_ALIAS}.event_ids
+                    WHERE event_id BETWEEN {low} AND {high}
+                    AND hour NOT IN ({_hour_literals(hours)})
+                )
+            """)
+
+        dropped = rows_in - con.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        if dropped:
+            logger.info("DuckDB - dropped {} already seen events", dropped)
+        return dropped
+
+    def record(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        table: str,
+        hour_expression: str,
+        hours: list[datetime],
+    ):
+        """
+        Replaces the ids of hours in the index with the events of table.
+
+        Must run inside attach, before table is written; restore undoes it when the
+        write fails, and release once it succeeded.
+
+        :param hour_expression: SQL expression of the hour of an event of table
+        """
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {PREVIOUS_IDS} AS
+            FROM {INDEX_ALIAS}.event_ids
+            WHERE hour IN ({_hour_literals(hours)})
+        """)
+        con.execute(f"""
+            DELETE FROM {INDEX_ALIAS}.event_ids
+            WHERE hour IN ({_hour_literals(hours)})
+        """)
+        con.execute(f"""
+            INSERT INTO {INDEX_ALIAS}.event_ids
+            SELECT event_id, {hour_expression} FROM {table} ORDER BY event_id
+        """)
+
+    def restore(self, con: duckdb.DuckDBPyConnection, hours: list[datetime]):
+        """
+        Puts back the ids hours had before record, when their write failed.
+
+        Must run inside attach.
+        """
+        con.execute(f"""
+            DELETE FROM {INDEX_ALIAS}.event_ids
+            WHERE hour IN ({_hour_literals(hours)})
+        """)
+        con.execute(f"""
+            INSERT INTO {INDEX_ALIAS}.event_ids
+            SELECT * FROM {PREVIOUS_IDS} ORDER BY event_id
+        """)
+        self.release(con)
+
+    def release(self, con: duckdb.DuckDBPyConnection):
+        """Drops the ids kept aside by record."""
+        con.execute(f"DROP TABLE IF EXISTS {PREVIOUS_IDS}")
@@ -0,0 +1,114 @@
+"""Delta Lake tables for the silver and gold zones.
+
+With [datalake] table_format = delta, each zone is a Delta table instead of loose
+parquet files:
+
+    s3://<silver_bucket>/gharchive/events/_delta/date=2024-10-10/hour=15/part-....parquet
+    s3://<silver_bucket>/gharchive/events/_delta/_delta_log/00000000000000000042.json
+
+A write replaces the partitions of its hours or day in a single commit to the
+transaction log, so readers see either the previous or the new version of a
+day, never a partly written one. The log also holds the row count and min/max
+of every column of each file, which lets readers prune files without opening
+them. Readers resolve the files of the latest snapshot from the log and scan
+them with DuckDB.
+
+Needs the optional deltalake package (pip install deltalake). DuckDB relations
+are handed over through the Arrow C stream interface, pyarrow is not required.
+"""
+
+import configparser
+
+import duckdb
+
+try:
+    import deltalake
+except ImportError:
+    deltalake = None
+
+
+def _require_deltalake():
+    if deltalake is None:
+        raise ImportError(
+            "table_format = delta needs the deltalake package: pip install deltalake"
+        )
+
+
+def storage_options(config: configparser.ConfigParser) -> dict[str, str]:
+    """S3 options of the Delta tables, from the [aws] section like DuckDB's secret."""
+    options = {
+        "AWS_ACCESS_KEY_ID": config.get("aws", "s3_access_key_id"),
+        "AWS_SECRET_ACCESS_KEY": config.get("aws", "s3_secret_access_key"),
+        "AWS_REGION": config.get("aws", "s3_region_name", fallback="") or "us-east-1",
+        # commits use S3 conditional writes, concurrent writers cannot overwrite
+        # each other's log entries
+        "conditional_put": "etag",
+    }
+    endpoint_url = config.get("aws", "s3_endpoint_url", fallback="")
+    if endpoint_url:
+        options["AWS_ENDPOINT_URL"] = endpoint_url
+        options["AWS_ALLOW_HTTP"] = str(endpoint_url.startswith("http://")).lower()
+    return options
+
+
+def write(
+    relation: duckdb.DuckDBPyRelation,
+    table_uri: str,
+    partition_by: list[str],
+    predicate: str,
+    options: dict[str, str],
+    writer_profile: dict | None = None,
+) -> int:
+    """
+    Replaces the rows matching predicate with relation, in one commit.
+
+    The table is created by the first write.
+
+    :param predicate: SQL filter on the partition columns, e.g. "date = '2024-10-10'"
+    :param writer_profile: compression, compression_level and row_group_size of
+        a parquet writer profile
+    :return: the version of the table after the commit
+    """
+    _require_deltalake()
+    writer_profile = writer_profile or {}
+    writer_properties = None
+    if "compression" in writer_profile or "row_group_size" in writer_profile:
+        writer_properties = deltalake.WriterProperties(
+            compression=writer_profile.get("compression", "snappy").upper(),
+            compression_level=writer_profile.get("compression_level"),
+            max_row_group_size=writer_profile.get("row_group_size"),
+        )
+
+    deltalake.write_deltalake(
+        table_uri,
+        relation,
+        mode="overwrite",
+        predicate=predicate,
+        partition_by=partition_by,
+        storage_options=options,
+        writer_properties=writer_properties,
+    )
+    return deltalake.DeltaTable(table_uri, storage_options=options).version()
+
+
+def snapshot_files(
+    con: duckdb.DuckDBPyConnection,
+    table_uri: str,
+    options: dict[str, str],
+    where: str = "true",
+) -> list[str]:
+    """
+    Files of the latest snapshot of a table, pruned with the statistics of the log.
+
+    :param where: SQL filter on the flattened add actions of the log, whose columns
+        are "partition.<column>", "min.<column>", "max.<column>" and num_records
+    """
+    _require_deltalake()
+    try:
+        table = deltalake.DeltaTable(table_uri, storage_options=options)
+    except deltalake.exceptions.TableNotFoundError:
+        return []
+
+    add_actions = con.from_arrow(table.get_add_actions(flatten=True))
+    rows = add_actions.filter(where).project("path").order("path").fetchall()
+    return [f"{table_uri}/{row[0]}" for row in rows]
@@ -0,0 +1,330 @@
+"""Synthetic GH Archive hours for benchmarks and scale tests.
+
+Events have the nested actor/repo/org/payload shape of the real archive, the
+event type mix of a typical 2024 hour and Zipf distributed repo and actor
+popularity. Rows are generated by DuckDB from range(), so producing gigabytes
+takes seconds rather than minutes, and randomness comes from hash() of the row
+number, which makes every hour reproducible for a given seed. Local files are
+gzipped as independent members on all cores, which readers see as one stream.
+
+    python scripts/gharchive_synth.py /tmp/gharchive --start 2024-10-10-00 --hours 24
+"""
+
+import argparse
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import duckdb
+from loguru import logger
+
+GZIP_MEMBER_SIZE = 16 * 1024 * 1024
+
+# share of each event type in a typical GH Archive hour (2024)
+EVENT_TYPE_WEIGHTS = {
+    "PushEvent": 0.46,
+    "CreateEvent": 0.12,
+    "PullRequestEvent": 0.08,
+    "WatchEvent": 0.07,
+    "IssueCommentEvent": 0.05,
+    "DeleteEvent": 0.04,
+    "PullRequestReviewEvent": 0.04,
+    "IssuesEvent": 0.03,
+    "ForkEvent": 0.02,
+    "PullRequestReviewCommentEvent": 0.02,
+    "ReleaseEvent": 0.01,
+    "CommitCommentEvent": 0.02,
+    "GollumEvent": 0.02,
+    "MemberEvent": 0.01,
+    "PublicEvent": 0.01,
+}
+
+
+def _uniform(salt: str, seed: int) -> str:
+    """SQL for a reproducible uniform [0, 1) value per row."""
+    return f"((hash(i, {seed}, '{salt}') % 4294967296) / 4294967296.0)"
+
+
+def _zipf(salt: str, seed: int, cardinality: int) -> str:
+    """SQL for a rank in [1, cardinality] with P(rank) roughly proportional to 1/rank."""
+    return (
+        f"least(CAST(floor(exp({_uniform(salt, seed)} * ln({cardinality}))) "
+        f"AS BIGINT), {cardinality})"
+    )
+
+
+def _event_type(seed: int) -> str:
+    total = sum(EVENT_TYPE_WEIGHTS.values())
+    cases = []
+    cumulative = 0.0
+    for event_type, weight in EVENT_TYPE_WEIGHTS.items():
+        cumulative += weight / total
+        cases.append(f"WHEN u < {cumulative} THEN '{event_type}'")
+    return f"CASE {' '.join(cases)} ELSE 'PushEvent' END"
+
+
+def hour_query(
+    process_date: datetime,
+    events: int,
+    repos: int = 1_000_000,
+    actors: int = 500_000,
+    max_commits: int = 5,
+    message_length: int = 80,
+    seed: int = 0,
+) -> str:
+    """
+    SELECT producing one hour of synthetic GH Archive events.
+
+    :param process_date: the hour the events are created in
+    :param events: number of events in the hour, the main size knob
+    :param repos: number of distinct repositories (Zipf distributed)
+    :param actors: number of distinct actors (Zipf distributed)
+    :param max_commits: upper bound of commits per PushEvent payload
+    :param message_length: length of commit messages and comment bodies
+    :param seed: changes every random choice, the same seed gives the same hour
+    """
+    hour_start = process_date.replace(minute=0, second=0, microsecond=0)
+    # ids keep growing across hours, like the real archive
+    id_base = int(hour_start.timestamp()) * 10_000
+    repo_rank = _zipf("repo", seed, repos)
+    actor_rank = _zipf("actor", seed, actors)
+
+    return f"""
+        WITH events AS (
+            SELECT
+            i,
+            {_uniform("type", seed)} AS u,
+            {repo_rank} AS repo_id,
+            {actor_rank} AS actor_id,
+            1 + CAST(hash(i, {seed}, 'commits') % {max_commits} AS INTEGER) AS commits
+            FROM range({events}) AS t(i)
+        ),
+        typed AS (
+            SELECT *, {_event_type(seed)} AS type FROM events
+        )
+        SELECT
+        CAST({id_base} + i AS VARCHAR) AS id,
+        type,
+        {{
+            'id': actor_id,
+            'login': 'user' || actor_id,
+            'display_login': 'user' || actor_id,
+            'gravatar_id': '',
+            'url': 'https://api.github.com/users/user' || actor_id,
+            'avatar_url': 'https://avatars.githubusercontent.com/u/' || actor_id || '?'
+        }} AS actor,
+        {{
+            'id': repo_id,
+            'name': 'org' || (repo_id % 100000) || '/repo' || repo_id,
+            'url': 'https://api.github.com/repos/org' || (repo_id % 100000)
+                || '/repo' || repo_id
+        }} AS repo,
+        CASE type
+            WHEN 'PushEvent' THEN json_object(
+                'repository_id', repo_id,
+                'push_id', {id_base} + i,
+                'size', commits,
+                'distinct_size', commits,
+                'ref', 'refs/heads/main',
+                'head', md5(CAST(i AS VARCHAR)) || '00000000',
+                'before', md5(CAST(i - 1 AS VARCHAR)) || '00000000',
+                'commits', list_transform(
+                    range(commits),
+                    c -> json_object(
+                        'sha', md5(CAST(i * 16 + c AS VARCHAR)) || '00000000',
+                        'author', json_object(
+                            'email', 'user' || actor_id || '@users.noreply.github.com',
+                            'name', 'user' || actor_id
+                        ),
+                        'message', repeat('x', {message_length}),
+                        'distinct', true,
+                        'url', 'https://api.github.com/repos/org/repo/commits/'
+                            || md5(CAST(i * 16 + c AS VARCHAR))
+                    )
+                )
+            )
+            WHEN 'WatchEvent' THEN json_object('action', 'started')
+            WHEN 'ForkEvent' THEN json_object(
+                'forkee', json_object('id', {id_base} + i, 'full_name', 'fork/repo' || i)
+            )
+            WHEN 'CreateEvent' THEN json_object(
+                'ref', 'feature-' || i,
+                'ref_type', 'branch',
+                'master_branch', 'main',
+                'description', repeat('d', {message_length} // 2),
+                'pusher_type', 'user'
+            )
+            WHEN 'DeleteEvent' THEN json_object(
+                'ref', 'feature-' || i, 'ref_type', 'branch', 'pusher_type', 'user'
+            )
+            WHEN 'IssueCommentEvent' THEN json_object(
+                'action', 'created',
+                'issue', json_object('id', i, 'number', i % 5000, 'title', 'issue ' || i),
+                'comment', json_object('id', i, 'body', repeat('c', {message_length}))
+            )
+            WHEN 'IssuesEvent' THEN json_object(
+                'action', 'opened',
+                'issue', json_object(
+                    'id', i, 'number', i % 5000, 'body', repeat('b', {message_length})
+                )
+            )
+            ELSE json_object(
+                'action', 'opened',
+                'number', i % 5000,
+                'body', repeat('p', {message_length})
+            )
+        END AS payload,
+        true AS public,
+        strftime(
+            TIMESTAMP '{hour_start:%Y-%m-%d %H:%M:%S}'
+                + to_microseconds(CAST(i * 3600000000 // {events} AS BIGINT)),
+            '%Y-%m-%dT%H:%M:%SZ'
+        ) AS created_at,
+        CASE WHEN repo_id % 3 = 0 THEN {{
+            'id': repo_id % 100000,
+            'login': 'org' || (repo_id % 100000)
+        }} END AS org
+        FROM typed
+    """
+
+
+def _ndjson_chunks(path: str, size: int):
+    """Yields blocks of about size bytes that end on a line boundary."""
+    with open(path, "rb") as source:
+        rest = b""
+        while block := source.read(size):
+            block = rest + block
+            cut = block.rfind(b"\n") + 1
+            yield block[:cut]
+            rest = block[cut:]
+        if rest:
+            yield rest
+
+
+def _gzip_members(source_path: str, target_path: str, compress_level: int):
+    """Gzips source_path into concatenated members, compressed in parallel.
+
+    zlib releases the GIL, so the threads compress on all cores. At most one
+    block per worker is held in memory at a time.
+    """
+    workers = os.cpu_count() or 1
+    with open(target_path, "wb") as target, ThreadPoolExecutor(workers) as executor:
+        pending = []
+        for block in _ndjson_chunks(source_path, GZIP_MEMBER_SIZE):
+            pending.append(
+                executor.submit(gzip.compress, block, compress_level, mtime=0)
+            )
+            if len(pending) >= workers:
+                target.write(pending.pop(0).result())
+        target.writelines(member.result() for member in pending)
+
+
+def write_hour(
+    con: duckdb.DuckDBPyConnection,
+    target_path: str,
+    process_date: datetime,
+    events: int,
+    compress_level: int = 3,
+    **options,
+):
+    """Writes one synthetic hour as gzipped NDJSON to a local or s3:// path."""
+    query = hour_query(process_date, events, **options)
+
+    # DuckDB gzips remote files itself, on a single thread
+    if "://" in target_path:
+        con.execute(
+            f"COPY ({query}) TO '{target_path}' (FORMAT JSON, COMPRESSION GZIP)"
+        )
+        return
+
+    ndjson_path = f"{target_path}.ndjson"
+    con.execute(f"COPY ({query}) TO '{ndjson_path}' (FORMAT JSON)")
+    try:
+        _gzip_members(ndjson_path, target_path, compress_level)
+    finally:
+        os.remove(ndjson_path)
+
+
+def gharchive_path(root: str, process_date: datetime) -> str:
+    """Path of an hour as published on data.gharchive.org."""
+    return f"{root}/{process_date:%Y-%m-%d-%H}.json.gz"
+
+
+def bronze_path(root: str, dataset_base_path: str, process_date: datetime) -> str:
+    """Path of an hour in the bronze layout of DataLakeTransformer._build_path."""
+    year_month_day = process_date.strftime("%Y-%m-%d")
+    hour = process_date.strftime("%H")
+    return f"{root}/{dataset_base_path}/{year_month_day}/{hour}/{year_month_day}-{hour}.json.gz"
+
+
+def generate_hours(
+    con: duckdb.DuckDBPyConnection,
+    root: str,
+    start: datetime,
+    hours: int,
+    events: int,
+    dataset_base_path: str | None = None,
+    **options,
+) -> list[str]:
+    """
+    Writes consecutive synthetic hours under root and returns their paths.
+
+    :param root: local directory or s3://bucket
+    :param dataset_base_path: write the bronze layout under this prefix (e.g. "gharchive/events")
+        instead of the flat data.gharchive.org layout
+    """
+    paths = []
+    for offset in range(hours):
+        process_date = start + timedelta(hours=offset)
+        if dataset_base_path is None:
+            target_path = gharchive_path(root, process_date)
+        else:
+            target_path = bronze_path(root, dataset_base_path, process_date)
+            if "://" not in root:
+                Path(target_path).parent.mkdir(parents=True, exist_ok=True)
+
+        logger.info("Generating {} events for {}", events, process_date)
+        write_hour(con, target_path, process_date, events, **options)
+        paths.append(target_path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root", help="output directory")
+    parser.add_argument("--start", default="2024-10-10-00", help="YYYY-MM-DD-HH")
+    parser.add_argument("--hours", type=int, default=1)
+    parser.add_argument("--events-per-hour", type=int, default=200_000)
+    parser.add_argument("--repos", type=int, default=1_000_000)
+    parser.add_argument("--actors", type=int, default=500_000)
+    parser.add_argument("--max-commits", type=int, default=5)
+    parser.add_argument("--message-length", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compress-level", type=int, default=3)
+    parser.add_argument(
+        "--dataset-base-path",
+        help='write the bronze layout under this prefix, e.g. "gharchive/events"',
+    )
+    args = parser.parse_args()
+
+    Path(args.root).mkdir(parents=True, exist_ok=True)
+    generate_hours(
+        duckdb.connect(),
+        args.root.rstrip("/"),
+        datetime.strptime(args.start, "%Y-%m-%d-%H"),
+        args.hours,
+        args.events_per_hour,
+        dataset_base_path=args.dataset_base_path,
+        repos=args.repos,
+        actors=args.actors,
+        max_commits=args.max_commits,
+        message_length=args.message_length,
+        seed=args.seed,
+        compress_level=args.compress_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Mergeable sketches of the gold days.
+
+Gold counts events per repo, event type and day. Counts of distinct users do not
+add up over days, and answering "unique users per repo per week" meant scanning
+the silver user ids of every day again. With [datalake] sketches = true the
+aggregation also writes two small summaries of each day:
+
+    s3://<gold_bucket>/gharchive/events/_sketches/2024-10-10/distinct_users.parquet
+        (repo_id, register, rank, precision)
+    s3://<gold_bucket>/gharchive/events/_sketches/2024-10-10/top_repos.parquet
+        (event_type, repo_id, event_count, threshold)
+
+distinct_users holds the HyperLogLog registers of the user ids of each repo, in
+sparse form: only the registers that are set. Days and repos merge by keeping
+the highest rank of each register, and the estimate of the merged registers has
+a relative standard error of about 1.04 / sqrt(2 ** precision), 1.6% at the
+default precision of 12.
+
+top_repos holds the `capacity` busiest repos of each event type, and of all
+events (event_type NULL), with their exact count; threshold is the count of the
+busiest repo left out. Over several days the count of a repo is at least the sum
+of the days it was kept and at most that plus the thresholds of the other days.
+"""
+
+DEFAULT_PRECISION = 12
+DEFAULT_CAPACITY = 100
+
+
+def registers_query(source: str, precision: int = DEFAULT_PRECISION) -> str:
+    """
+    HyperLogLog registers of the user ids of each repo of source.
+
+    The low precision bits of the user id hash pick the register, the rank is the
+    position of the lowest set bit of the others, capped at 64 - precision + 1.
+    The hash is the lower half of the md5 of the user id, unlike hash() it does
+    not change between DuckDB versions, so registers of any day merge.
+    """
+    if not 4 <= precision <= 16:
+        raise ValueError(
+            f"HyperLogLog precision must be between 4 and 16, not {precision}"
+        )
+    return f"""
+        SELECT
+        repo_id,
+        register,
+        CAST(max(bit_count(xor(bits, bits - 1))) AS UTINYINT) AS rank,
+        CAST({precision} AS UTINYINT) AS precision
+        FROM (
+            SELECT
+            repo_id,
+            CAST(user_hash & {2**precision - 1} AS USMALLINT) AS register,
+            (user_hash >> {precision}) | (1::UBIGINT << {64 - precision}) AS bits
+            FROM (
+                SELECT repo_id, md5_number_lower(CAST(user_id AS VARCHAR)) AS user_hash
+                FROM {source}
+                WHERE user_id IS NOT NULL
+            )
+        )
+        GROUP BY ALL
+    """
+
+
+def merge_registers_query(sources: list[str], group_by: list[str]) -> str:
+    """
+    Union of the registers of sources, per group_by (e.g. ["repo_id"], or [] for all).
+    """
+    return f"""
+        SELECT {"".join(f"{column}, " for column in group_by)}register, max(rank) AS rank, precision
+        FROM ({" UNION ALL ".join(f"SELECT * FROM {source}" for source in sources)})
+        GROUP BY ALL
+    """
+
+
+def estimate_query(registers: str, group_by: list[str]) -> str:
+    """
+    Estimated distinct users of the merged registers of each group.
+
+    Small counts, where most registers are still unset, use linear counting.
+    """
+    groups = "".join(f"{column}, " for column in group_by)
+    return f"""
+        SELECT {groups}CAST(round(
+            CASE
+                WHEN raw_estimate <= 2.5 * registers AND set_registers < registers
+                THEN registers * ln(registers / (registers - set_registers))
+                ELSE raw_estimate
+            END
+        ) AS BIGINT) AS distinct_users
+        FROM (
+            SELECT
+            {groups}
+            2 ** any_value(precision) AS registers,
+            count(*) AS set_registers,
+            (0.7213 / (1 + 1.079 / registers)) * registers ** 2
+                / (sum(2 ** -CAST(rank AS INTEGER)) + registers - set_registers) AS raw_estimate
+            FROM {registers}
+            GROUP BY ALL
+        )
+    """
+
+
+def top_repos_query(aggregate: str, capacity: int = DEFAULT_CAPACITY) -> str:
+    """
+    The capacity busiest repos of each event type and of all events, of a gold day.
+
+    :param aggregate: table of the exact counts of the day (event_type, repo_id, event_count)
+    """
+    return f"""
+        SELECT event_type, repo_id, event_count, threshold
+        FROM (
+            SELECT
+            *,
+            coalesce(
+                max(event_count) FILTER (WHERE position > {capacity})
+                    OVER (PARTITION BY event_type),
+                0
+            ) AS threshold
+            FROM (
+                SELECT
+                *,
+                row_number() OVER (
+                    PARTITION BY event_type ORDER BY event_count DESC, repo_id
+                ) AS position
+                FROM (
+                    SELECT event_type, repo_id, CAST(sum(event_count) AS BIGINT) AS event_count
+                    FROM {aggregate}
+                    GROUP BY GROUPING SETS ((event_type, repo_id), (repo_id))
+                )
+            )
+        )
+        WHERE position <= {capacity}
+    """
+
+
+def merge_top_repos_query(source: str, k: int, event_type: str | None = None) -> str:
+    """
+    The k busiest repos over the days of source, with the bounds of their counts.
+
+    event_count is the sum of the days the repo was kept, max_event_count adds the
+    threshold of the days it was not.
+
+    :param source: top_repos rows of several days, with a filename column
+    :param event_type: None for all events
+    """
+    if event_type is None:
+        condition = "event_type IS NULL"
+    else:
+        escaped = event_type.replace("'", "''")
+        condition = f"event_type = '{escaped}'"
+    return f"""
+        WITH days AS (
+            SELECT * FROM {source} WHERE {condition}
+        ),
+        thresholds AS (
+            SELECT sum(threshold) AS threshold
+            FROM (SELECT DISTINCT filename, threshold FROM days)
+        )
+        SELECT
+        repo_id,
+        CAST(sum(event_count) AS BIGINT) AS event_count,
+        CAST(sum(event_count) + any_value(thresholds.threshold) - sum(days.threshold) AS BIGINT)
+            AS max_event_count
+        FROM days, thresholds
+        GROUP BY repo_id
+        ORDER BY event_count DESC, repo_id
+        LIMIT {k}
+    """
@@ -0,0 +1,85 @@
+"""Per-stage timing and row/byte metrics of the pipeline, one JSON line per stage.
+
+dagster_project/dagster_project/resources/instrumentation.py is a copy of the
+Instrumentation class: the Dagster code location is installed as its own
+package and cannot import from scripts/, like its copy of the transformer.
+Change both together.
+"""
+
+import configparser
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from pathlib import Path
+
+DEFAULT_METRICS_PATH = Path(__file__).parent / "logs" / "metrics.jsonl"
+
+
+def metrics_path_from_config(config: configparser.ConfigParser) -> Path | None:
+    """[metrics] path of config.ini, an empty value turns the metrics file off."""
+    metrics_path = config.get("metrics", "path", fallback=str(DEFAULT_METRICS_PATH))
+    return Path(metrics_path) if metrics_path else None
+
+
+class Instrumentation:
+    """Times pipeline stages and emits one JSON line of metrics per stage.
+
+    Stages fill in the record they are given (rows_in, rows_out, bytes_in,
+    bytes_out, ...). With profile enabled, SQL stages also attach the output of
+    DuckDB's EXPLAIN ANALYZE to their record.
+    """
+
+    def __init__(self, metrics_path: Path | None = None, profile: bool = False):
+        self.metrics_path = metrics_path
+        self.profile = profile
+        self.stages: list[dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        record = {
+            "stage": name,
+            "started_at": datetime.now(UTC).isoformat(),
+            **fields,
+        }
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 3)
+            self._emit(record)
+
+    def _emit(self, record: dict):
+        with self._lock:
+            self.stages.append(record)
+            if self.metrics_path is None:
+                return
+            self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.metrics_path, "a") as metrics_file:
+                metrics_file.write(
+                    json.dumps(record, default=str, ensure_ascii=False) + "\n"
+                )
+
+    def metadata(self) -> dict:
+        """Flat {stage.metric: value} view of the recorded stages.
+
+        Meant for orchestrator metadata such as Dagster's MaterializeResult.
+        Repeated stages are numbered from the second one on (write, write_2, ...).
+        """
+        metadata = {}
+        seen: dict[str, int] = {}
+        for record in self.stages:
+            seen[record["stage"]] = seen.get(record["stage"], 0) + 1
+            name = record["stage"]
+            if seen[name] > 1:
+                name = f"{name}_{seen[name]}"
+            for key, value in record.items():
+                if key in ("stage", "started_at") or value is None:
+                    continue
+                metadata[f"{name}.{key}"] = value
+        return metadata
@@ -18,16 +18,16 @@ logger.add(
 
 def main():
     try:
-        transformer = DataLakeTransformer(dataset_base_path="gharchive/events")
-        now = datetime.now(dt.timezone.utc)
+        now = datetime.now(dt.UTC)
         # Calculate the process_date for the previous day's data aggregation
         process_date = now.replace(
             hour=0, minute=0, second=0, microsecond=0
         ) - timedelta(days=1)
-        transformer.aggregate_silver_data(process_date)
+        with DataLakeTransformer(dataset_base_path="gharchive/events") as transformer:
+            transformer.aggregate_silver_data(process_date)
         logger.info(f"Successfully aggregated bronze data for {process_date}")
     except Exception as e:
-        logger.error(f"Error in aggregate_silver_data: {str(e)}")
+        logger.error(f"Error in aggregate_silver_data: {e!s}")
 
 
 if __name__ == "__main__":
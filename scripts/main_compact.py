@@ -0,0 +1,66 @@
+import argparse
+import datetime as dt
+import sys
+from datetime import datetime, timedelta
+
+from data_lake_transformer import TRANSFORM_ERRORS, DataLakeTransformer
+from loguru import logger
+
+# Setup logging
+logger.remove()
+
+logger.add(
+    sys.stderr,
+    colorize=True,
+)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Compact the hourly silver files of finished days into daily files"
+    )
+    parser.add_argument(
+        "--start",
+        type=lambda value: datetime.strptime(value, "%Y-%m-%d"),
+        help="first day, YYYY-MM-DD, defaults to yesterday",
+    )
+    parser.add_argument(
+        "--end",
+        type=lambda value: datetime.strptime(value, "%Y-%m-%d"),
+        help="last day, YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--repo-dimension",
+        action="store_true",
+        help="also collapse the daily files of the repo dimension (gold_model = star)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.start is None:
+        now = datetime.now(dt.UTC)
+        args.start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(
+            days=1
+        )
+
+    failed = False
+    with DataLakeTransformer(dataset_base_path="gharchive/events") as transformer:
+        day = args.start
+        while day <= (args.end or args.start):
+            try:
+                transformer.compact_silver_day(day)
+            except TRANSFORM_ERRORS as e:
+                logger.error(f"Error in compact_silver_day for {day:%Y-%m-%d}: {e!s}")
+                failed = True
+            day += timedelta(days=1)
+        if args.repo_dimension:
+            try:
+                transformer.compact_repo_dimension()
+            except TRANSFORM_ERRORS as e:
+                logger.error(f"Error in compact_repo_dimension: {e!s}")
+                failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
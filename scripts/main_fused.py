@@ -0,0 +1,82 @@
+"""Ingests and transforms one hour without reading it back from the bronze zone.
+
+The hour is downloaded to a local spool file, transformed into the silver zone
+from that file while the same file is uploaded to the bronze zone in the
+background. Freshness improves by a full S3 write and read of the raw hour.
+"""
+
+import argparse
+import datetime as dt
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from data_lake_ingester import DataLakeIngester
+from data_lake_transformer import DataLakeTransformer
+from loguru import logger
+from main_ingest import parse_hour
+
+
+def ingest_and_transform(
+    ingester: DataLakeIngester,
+    transformer: DataLakeTransformer,
+    process_date: datetime,
+    force: bool = False,
+    **transform_options,
+) -> int:
+    """
+    Lands one hour in the bronze zone and writes its silver file in one pass.
+
+    An hour that has already landed unchanged is transformed from the bronze zone.
+
+    :param force: download the hour even if it has already landed
+    :param transform_options: passed on to DataLakeTransformer.transform
+    :return: the number of bytes landed, 0 if the hour had already landed
+    """
+    if not force and ingester.has_landed(process_date):
+        logger.info("{} already landed, transforming from bronze", process_date)
+        transformer.transform(process_date, **transform_options)
+        return 0
+
+    with (
+        tempfile.TemporaryDirectory(prefix="gharchive-spool-") as spool_dir,
+        ThreadPoolExecutor(max_workers=1) as uploads,
+    ):
+        spool_path = Path(spool_dir) / f"{process_date:%Y-%m-%d-%H}.json.gz"
+        upload = ingester.spool_hourly_gharchive(process_date, spool_path, uploads)
+        transformer.transform(
+            process_date, source_path=str(spool_path), **transform_options
+        )
+        # the silver file is written, the spool file goes once it has landed too
+        return upload.result()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hour", type=parse_hour, help="hour, YYYY-MM-DD-HH")
+    parser.add_argument(
+        "--force", action="store_true", help="re-ingest an hour that already landed"
+    )
+    args = parser.parse_args(argv)
+
+    process_date = args.hour
+    if process_date is None:
+        now = datetime.now(dt.UTC)
+        process_date = now.replace(minute=0, second=0, microsecond=0) - timedelta(
+            hours=3
+        )
+
+    ingest_and_transform(
+        DataLakeIngester("gharchive/events"),
+        DataLakeTransformer("gharchive/events"),
+        process_date,
+        force=args.force,
+        projected=True,
+        single_pass=True,
+    )
+    logger.success("Ingested and transformed {}", process_date)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,57 @@
+import argparse
 import datetime as dt
 from datetime import datetime, timedelta
 
 from data_lake_ingester import DataLakeIngester
 
 
-def main():
+def parse_hour(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d-%H").replace(tzinfo=dt.UTC)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Ingest GH Archive hours into S3")
+    parser.add_argument("--start", type=parse_hour, help="first hour, YYYY-MM-DD-HH")
+    parser.add_argument("--end", type=parse_hour, help="last hour, YYYY-MM-DD-HH")
+    parser.add_argument("--workers", type=int, help="parallel downloads")
+    parser.add_argument(
+        "--force", action="store_true", help="re-ingest hours that already landed"
+    )
+    parser.add_argument(
+        "--recompress",
+        action="store_true",
+        help="re-encode the landed hours into parallel-decompressible chunks",
+    )
+    args = parser.parse_args(argv)
+
     ingester = DataLakeIngester("gharchive/events")
 
-    now = datetime.now(dt.timezone.utc)
+    if args.recompress:
+        if not args.start:
+            parser.error("--recompress needs --start")
+        process_date = args.start
+        while process_date <= (args.end or args.start):
+            ingester.recompress_hourly_gharchive(process_date)
+            process_date += timedelta(hours=1)
+        return
+
+    if args.start:
+        summary = ingester.ingest_range(
+            args.start,
+            args.end or args.start,
+            max_workers=args.workers,
+            force=args.force,
+        )
+        if summary["hours_failed"]:
+            raise SystemExit(1)
+        return
+
+    now = datetime.now(dt.UTC)
 
     # 2024-10-20 00:00:00+00:00
     process_date = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
 
-    ingester.ingest_hourly_gharchive(process_date)
+    ingester.ingest_hourly_gharchive(process_date, force=args.force)
 
 
 if __name__ == "__main__":
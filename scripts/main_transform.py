@@ -1,3 +1,4 @@
+import argparse
 import datetime as dt
 import sys
 from datetime import datetime, timedelta
@@ -5,6 +6,8 @@ from datetime import datetime, timedelta
 # Add the parent directory to the Python path
 from data_lake_transformer import DataLakeTransformer
 from loguru import logger
+from main_ingest import parse_hour
+from transform_pool import transform_hours
 
 # Setup logging
 logger.remove()
@@ -15,17 +18,43 @@ logger.add(
 )
 
 
-def main():
-    try:
-        transformer = DataLakeTransformer(dataset_base_path="gharchive/events")
-        now = datetime.now(dt.timezone.utc)
-        process_date = now.replace(minute=0, second=0, microsecond=0) - timedelta(
-            hours=3
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Transform GH Archive hours to silver")
+    parser.add_argument("--start", type=parse_hour, help="first hour, YYYY-MM-DD-HH")
+    parser.add_argument("--end", type=parse_hour, help="last hour, YYYY-MM-DD-HH")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="transform the range hour by hour in this many worker processes",
+    )
+    args = parser.parse_args(argv)
+
+    if args.start and args.workers:
+        summary = transform_hours(
+            "gharchive/events",
+            args.start,
+            args.end or args.start,
+            workers=args.workers,
         )
-        transformer.transform(process_date)
+        if summary["hours_failed"]:
+            raise SystemExit(1)
+        return
+
+    try:
+        with DataLakeTransformer(dataset_base_path="gharchive/events") as transformer:
+            if args.start:
+                # catch-up: all the hours in one scan
+                hours = transformer.transform_range(args.start, args.end or args.start)
+                logger.success(f"Successfully serialised {hours} hours of raw data")
+                return
+            now = datetime.now(dt.UTC)
+            process_date = now.replace(minute=0, second=0, microsecond=0) - timedelta(
+                hours=3
+            )
+            transformer.transform(process_date)
         logger.success(f"Successfully serialised raw data for {process_date}")
     except Exception as e:
-        logger.error(f"Error in serialise_raw_data: {str(e)}")
+        logger.error(f"Error in serialise_raw_data: {e!s}")
 
 
 if __name__ == "__main__":
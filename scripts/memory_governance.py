@@ -0,0 +1,80 @@
+"""Sizes DuckDB to the resources the process may really use.
+
+DuckDB defaults its memory_limit to 80% of the machine's physical memory and its
+threads to every core, both read from the host. In a container limited by a
+cgroup that is more than the container is allowed, so a peak hour or a wide
+GROUP BY is OOM-killed before DuckDB considers spilling. The limits here come
+from the cgroup (v2 or v1) when there is one.
+"""
+
+import math
+import os
+from pathlib import Path
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def _read_cgroup_file(*names: str) -> str | None:
+    for name in names:
+        try:
+            return (CGROUP_ROOT / name).read_text().strip()
+        except OSError:
+            continue
+    return None
+
+
+def cgroup_memory_limit() -> int | None:
+    """Memory limit of the cgroup in bytes, None when unlimited or outside a cgroup."""
+    value = _read_cgroup_file("memory.max", "memory/memory.limit_in_bytes")
+    if value is None or value == "max":
+        return None
+    limit = int(value)
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    if limit >= 1 << 60:
+        return None
+    return limit
+
+
+def cgroup_cpu_limit() -> float | None:
+    """CPU quota of the cgroup in cores, None when unlimited or outside a cgroup."""
+    value = _read_cgroup_file("cpu.max")
+    if value is not None:
+        quota, period = value.split()
+        return None if quota == "max" else int(quota) / int(period)
+
+    quota = _read_cgroup_file("cpu/cpu.cfs_quota_us")
+    period = _read_cgroup_file("cpu/cpu.cfs_period_us")
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+
+def available_memory_bytes() -> int:
+    """Memory the process may use: the cgroup limit, capped by the physical memory."""
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    limit = cgroup_memory_limit()
+    return min(limit, physical) if limit else physical
+
+
+def available_cpus() -> int:
+    """Cores the process may use: its CPU affinity, capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def memory_limit(fraction: float = 0.8, share: int = 1) -> str:
+    """
+    DuckDB memory_limit for one of share connections, such as "3072MB".
+
+    :param fraction: part of the available memory given to DuckDB in total, the rest
+        is left to Python, the OS page cache and S3 buffers
+    :param share: number of connections splitting that memory
+    """
+    memory_mb = int(available_memory_bytes() * fraction / share / 1024 / 1024)
+    return f"{max(memory_mb, 256)}MB"
@@ -0,0 +1,131 @@
+"""Local catalog of the files the pipeline has written to each zone.
+
+Readers used to find their input by globbing S3, a LIST request per prefix and
+then a footer read per file before any data is scanned, with nothing telling an
+empty hour from a missing one. The ingester and the transformer instead record
+every file they write in a DuckDB database:
+
+    partitions(path, zone, partition_hour, rows, bytes,
+               min_event_date, max_event_date, schema_hash, written_at)
+
+and readers resolve their exact file list from it. Bronze files have no row
+count or event dates, the ingester does not parse them.
+
+A DuckDB database has a single writer; processes sharing the catalog take turns
+through a lock file next to it.
+"""
+
+import configparser
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+
+
+def partition_catalog_from_config(
+    config: configparser.ConfigParser,
+) -> "PartitionCatalog | None":
+    """Catalog of [datalake] catalog, None when unset."""
+    path = config.get("datalake", "catalog", fallback="")
+    return PartitionCatalog(Path(path)) if path else None
+
+
+class PartitionCatalog:
+    def __init__(self, path: Path):
+        """
+        :param path: the DuckDB database file of the catalog, created when missing
+        """
+        self.path = path
+
+    @contextmanager
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            con = duckdb.connect(str(self.path))
+            try:
+                con.execute("""
+                    CREATE TABLE IF NOT EXISTS partitions (
+                        path VARCHAR PRIMARY KEY,
+                        zone VARCHAR,
+                        partition_hour TIMESTAMP,
+                        rows BIGINT,
+                        bytes BIGINT,
+                        min_event_date TIMESTAMP,
+                        max_event_date TIMESTAMP,
+                        schema_hash VARCHAR,
+                        written_at TIMESTAMP
+                    )
+                """)
+                yield con
+            finally:
+                con.close()
+
+    def record(
+        self,
+        zone: str,
+        path: str,
+        partition_hour: datetime,
+        size: int | None,
+        rows: int | None = None,
+        min_event_date: datetime | None = None,
+        max_event_date: datetime | None = None,
+        schema_hash: str | None = None,
+    ):
+        """
+        Adds a written file, or replaces the entry of a rewritten one.
+
+        :param zone: "bronze", "silver" or "gold"
+        :param partition_hour: the hour of the file, midnight for a daily file
+        :param size: size of the file in bytes
+        """
+        with self._connect() as con:
+            con.execute(
+                """
+                INSERT OR REPLACE INTO partitions VALUES (
+                    ?, ?, ?, ?, ?, ?, ?, ?, current_timestamp::TIMESTAMP
+                )
+                """,
+                [
+                    path,
+                    zone,
+                    partition_hour.replace(tzinfo=None),
+                    rows,
+                    size,
+                    min_event_date,
+                    max_event_date,
+                    schema_hash,
+                ],
+            )
+
+    def remove(self, path_prefix: str):
+        """Forgets the files under path_prefix, e.g. deleted chunks."""
+        with self._connect() as con:
+            con.execute(
+                "DELETE FROM partitions WHERE starts_with(path, ?)", [path_prefix]
+            )
+
+    def files(self, zone: str, start_hour: datetime, end_hour: datetime) -> list[str]:
+        """
+        Files of zone with a partition hour between start_hour and end_hour (inclusive).
+
+        Files recorded without any rows are left out.
+        """
+        with self._connect() as con:
+            rows = con.execute(
+                """
+                SELECT path FROM partitions
+                WHERE zone = ?
+                AND partition_hour BETWEEN ? AND ?
+                AND rows IS DISTINCT FROM 0
+                ORDER BY path
+                """,
+                [
+                    zone,
+                    start_hour.replace(tzinfo=None),
+                    end_hour.replace(tzinfo=None),
+                ],
+            ).fetchall()
+        return [row[0] for row in rows]
@@ -0,0 +1,139 @@
+"""Versioned JSON schemas of the raw GH Archive events.
+
+read_json_auto samples every hour to infer the deeply nested event schema, which
+lets the column types drift from one hour to the next. The registry stores the
+inferred columns once as a numbered JSON file:
+
+    schemas/gharchive_events.v1.json
+    schemas/gharchive_events.v2.json
+
+and later hours are read with read_json(columns=...) of the latest version. Before
+that, the keys of the first events of the hour, nested keys included, are compared
+with the keys the version has seen, the same head read_json_auto samples; only an
+hour with new keys is inferred again, and the result, merged with the previous
+columns, becomes the next version. Keys that only appear past the head are missed,
+as they would be by inference.
+"""
+
+import json
+from datetime import UTC, datetime
+from pathlib import Path
+
+import duckdb
+from loguru import logger
+
+
+def _keys(structure: dict | list | str, prefix: str = "") -> set[str]:
+    """
+    Dotted paths of the keys of a json_group_structure.
+
+    The keys of objects in arrays are walked as keys of the array, and a key whose
+    values do not share one structure ("JSON") is not walked further.
+    """
+    if isinstance(structure, list):
+        return _keys(structure[0], prefix) if structure else set()
+    if not isinstance(structure, dict):
+        return set()
+    keys = set()
+    for key, value in structure.items():
+        keys.add(prefix + key)
+        keys |= _keys(value, f"{prefix}{key}.")
+    return keys
+
+
+class SchemaRegistry:
+    def __init__(
+        self,
+        directory: Path,
+        name: str = "gharchive_events",
+        sample_rows: int = 20_480,
+    ):
+        """
+        :param directory: where the versions are stored
+        :param name: prefix of the version files
+        :param sample_rows: first events of each hour checked for new keys
+        """
+        self.directory = directory
+        self.name = name
+        if sample_rows < 1:
+            raise ValueError(f"schema_sample_rows must be positive, not {sample_rows}")
+        self.sample_rows = sample_rows
+        self._latest: dict | None = None
+
+    def _version_path(self, version: int) -> Path:
+        return self.directory / f"{self.name}.v{version}.json"
+
+    def latest(self) -> dict | None:
+        """The newest stored version, None before the first registration."""
+        versions = sorted(
+            int(path.name.removeprefix(f"{self.name}.v").removesuffix(".json"))
+            for path in self.directory.glob(f"{self.name}.v*.json")
+        )
+        if not versions:
+            return None
+        if self._latest is None or self._latest["version"] != versions[-1]:
+            self._latest = json.loads(self._version_path(versions[-1]).read_text())
+        return self._latest
+
+    def _sample_keys(self, con: duckdb.DuckDBPyConnection, files: str) -> set[str]:
+        """Keys at every depth of the first events, like payload.pull_request.title."""
+        # the head only, the rest of the hour is neither read nor decompressed
+        structure = con.execute(f"""
+            SELECT json_group_structure(json) FROM (
+                SELECT json FROM read_json_objects(
+                    {files}, format='newline_delimited', ignore_errors=true
+                )
+                LIMIT {self.sample_rows}
+            )
+        """).fetchone()[0]
+        return _keys(json.loads(structure)) if structure else set()
+
+    def _infer_columns(
+        self, con: duckdb.DuckDBPyConnection, files: str
+    ) -> dict[str, str]:
+        rows = con.execute(
+            f"DESCRIBE SELECT * FROM read_json_auto({files}, ignore_errors=true)"
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def _register(self, columns: dict[str, str], keys: set[str], source: str) -> dict:
+        latest = self.latest()
+        schema = {
+            "version": latest["version"] + 1 if latest else 1,
+            "registered_at": datetime.now(UTC).isoformat(),
+            "source": source,
+            "columns": columns,
+            "keys": sorted(keys),
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            # exclusive create, a concurrent transform may register the same version
+            with open(self._version_path(schema["version"]), "x") as version_file:
+                json.dump(schema, version_file, indent=2)
+        except FileExistsError:
+            logger.info("Schema version {} registered concurrently", schema["version"])
+            return self.latest()
+
+        self._latest = schema
+        logger.success("Registered {} schema version {}", self.name, schema["version"])
+        return schema
+
+    def columns(self, con: duckdb.DuckDBPyConnection, files: str) -> dict[str, str]:
+        """
+        Columns to read files with, inferred only when the first events have unseen keys.
+
+        :param files: a quoted path or a DuckDB list of paths
+        """
+        latest = self.latest()
+        keys = self._sample_keys(con, files)
+        if latest is not None and keys <= set(latest["keys"]):
+            return latest["columns"]
+
+        new_keys = keys - set(latest["keys"]) if latest else keys
+        logger.info("New keys {}, inferring the schema of {}", sorted(new_keys), files)
+        columns = self._infer_columns(con, files)
+        if latest is not None:
+            # columns this hour lacks (like org) keep their registered type
+            columns = {**latest["columns"], **columns}
+            keys |= set(latest["keys"])
+        return self._register(columns, keys, files)["columns"]
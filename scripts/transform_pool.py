@@ -0,0 +1,152 @@
+"""Transforms many hours in parallel worker processes with bounded DuckDB budgets.
+
+One DuckDB database in one process already uses every core, but a single hour
+does not keep them busy: decompressing the gzipped JSON is serial per file and
+S3 round trips leave cores idle. Several worker processes each transforming their
+own hours fill those gaps. Each worker gets an equal share of the cores and of
+the memory, set as `threads` and `memory_limit` on its connection, so that the
+workers together never ask for more than the machine has.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import memory_governance
+from data_lake_transformer import TRANSFORM_ERRORS, DataLakeTransformer
+from loguru import logger
+
+# set in each worker process by _init_worker
+_transformer: DataLakeTransformer | None = None
+
+
+def worker_budget(workers: int, memory_fraction: float = 0.8) -> tuple[int, str]:
+    """
+    Threads and memory limit of each of workers processes.
+
+    Cores and memory are those the cgroup allows, see memory_governance.
+
+    :param memory_fraction: see memory_governance.memory_limit
+    :return: threads and a DuckDB memory_limit such as "3072MB"
+    """
+    threads = max(1, memory_governance.available_cpus() // workers)
+    return threads, memory_governance.memory_limit(memory_fraction, workers)
+
+
+def _init_worker(
+    dataset_base_path: str,
+    config_path: Path | None,
+    threads: int,
+    memory_limit: str,
+):
+    global _transformer
+    _transformer = DataLakeTransformer(
+        dataset_base_path,
+        config_path,
+        threads=threads,
+        memory_limit=memory_limit,
+    )
+
+
+def _transform_hour(process_date: datetime, options: dict) -> tuple[int, int]:
+    """Transforms one hour in a worker, returns its bytes read and rows written."""
+    stages = len(_transformer.instrumentation.stages)
+    _transformer.transform(process_date, **options)
+
+    bytes_in = rows_out = 0
+    for record in _transformer.instrumentation.stages[stages:]:
+        bytes_in += record.get("bytes_in") or 0
+        if record["stage"] in ("write", "serialize_clean_write"):
+            rows_out += record.get("rows_out") or 0
+    return bytes_in, rows_out
+
+
+def transform_hours(
+    dataset_base_path: str,
+    start_date: datetime,
+    end_date: datetime,
+    workers: int | None = None,
+    config_path: Path | None = None,
+    memory_fraction: float = 0.8,
+    **options,
+) -> dict:
+    """
+    Transforms every hour between start_date and end_date (both inclusive) in a process pool.
+
+    :param workers: number of worker processes, defaults to one per 4 cores
+    :param memory_fraction: see worker_budget
+    :param options: passed on to DataLakeTransformer.transform
+    :return: summary with the failed hours and the aggregate throughput
+    """
+    start_date = start_date.replace(minute=0, second=0, microsecond=0)
+    end_date = end_date.replace(minute=0, second=0, microsecond=0)
+    if end_date < start_date:
+        raise ValueError(f"end ({end_date}) is before start ({start_date})")
+
+    hours = []
+    process_date = start_date
+    while process_date <= end_date:
+        hours.append(process_date)
+        process_date += timedelta(hours=1)
+
+    if workers is None:
+        workers = max(1, memory_governance.available_cpus() // 4)
+    workers = min(workers, len(hours))
+    threads, memory_limit = worker_budget(workers, memory_fraction)
+
+    logger.info(
+        "Transforming {} hours with {} workers of {} threads and {} each",
+        len(hours),
+        workers,
+        threads,
+        memory_limit,
+    )
+
+    total_bytes = total_rows = 0
+    failed = []
+    started_at = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        # a fresh interpreter, nothing of the parent's DuckDB state is inherited
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(dataset_base_path, config_path, threads, memory_limit),
+    ) as executor:
+        futures = {
+            executor.submit(_transform_hour, hour, options): hour for hour in hours
+        }
+        for future in as_completed(futures):
+            hour = futures[future]
+            try:
+                bytes_in, rows_out = future.result()
+                total_bytes += bytes_in
+                total_rows += rows_out
+            except (*TRANSFORM_ERRORS, BrokenProcessPool) as e:
+                logger.error(
+                    "Failed to transform {}: {}", hour.strftime("%Y-%m-%d-%H"), e
+                )
+                failed.append(hour)
+
+    elapsed = time.perf_counter() - started_at
+    transformed = len(hours) - len(failed)
+
+    summary = {
+        "hours_requested": len(hours),
+        "hours_transformed": transformed,
+        "hours_failed": [hour.strftime("%Y-%m-%d-%H") for hour in sorted(failed)],
+        "workers": workers,
+        "threads_per_worker": threads,
+        "memory_limit_per_worker": memory_limit,
+        "bytes": total_bytes,
+        "rows": total_rows,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(total_bytes / 1024 / 1024 / elapsed, 2) if elapsed else None,
+        "rows_per_s": round(total_rows / elapsed) if elapsed else None,
+        "hours_per_min": round(transformed / elapsed * 60, 2) if elapsed else None,
+    }
+    logger.info("Transform summary: {}", summary)
+    return summary